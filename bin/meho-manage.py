@@ -46,9 +46,10 @@ class MehoClient(object):
         ~~~~~~~~~~
 
             meho-manage media list   [-u user] [-p password] [-f filter...]
-                                     <api>
+                                     [-l limit] <api>
 
-                Prints the ID of all stored media.
+                Prints the ID of all stored media, requesting them ``limit``
+                at a time.
 
             meho-manage media detail [-u user] [-p [password]] <media_urn> <api>
 
@@ -126,25 +127,42 @@ class MehoClient(object):
         parser.add_argument('-p', '--password', help='password of your meho account')
         parser.add_argument('-f', '--filters', action='append', default=[],
             help='list of query filters')
+        parser.add_argument('-l', '--limit', type=int,
+            help='number of media requested at once (defaults to the server page size)')
         parser.add_argument('api', help='root url to the API endpoint')
         args = parser.parse_args(args)
 
         # request API for media list
-        filters = {k:v for k,v in map(lambda f: f.split('='), args.filters)}
+        params = {k:v for k,v in map(lambda f: f.split('=', 1), args.filters)}
+        if args.limit:
+            params['limit'] = args.limit
         auth = self._get_credentials(args)
         endpoint = self._format_url(args.api) + 'media/'
-        r = requests.get(endpoint, auth=auth, params=filters)
+        session = requests.Session()
 
-        # parse the server response
-        if r.status_code == 200:
-            data = r.json()
-            if data['media']:
+        # the list is paginated; follow the next links until the last page
+        count = 0
+        while endpoint:
+            r = session.get(endpoint, auth=auth, params=params)
+
+            # parse the server response
+            if r.status_code == 200:
+                data = r.json()
                 for media in data['media']:
                     print(media['urn'])
+                count += len(data['media'])
+
+                # next links already hold the filters and the limit
+                endpoint, params = data.get('next'), None
+            elif r.status_code == 401:
+                self._handle_401(r)
+                return
             else:
-                print('No stored media')
-        elif r.status_code == 401:
-            self._handle_401(r)
+                print(r.text, file=sys.stderr)
+                return
+
+        if not count:
+            print('No stored media')
 
     def media_detail(self, *args):
         # parse command line options
@@ -15,25 +15,61 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import re, threading, time
+import meho.settings as meho_settings
+
+from collections import OrderedDict
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_by_path
+from meho.models import Credentials
 from requests.auth import AuthBase
+from requests.cookies import extract_cookies_to_jar
+try:
+    from urllib import parse as urlparse
+except:
+    import urlparse
 
 class AutoAuth(AuthBase):
+    """
+    A requests authentication handler picking credentials from ``identities`` (the
+    ``Credentials`` of the origins) when a server replies with a 401 challenge.
+
+    Authentication handlers are cached per origin, authentication scheme and realm, in a LRU
+    of ``MEHO_AUTH_HANDLER_CACHE_SIZE`` entries; requests to an origin that was already
+    authenticated are sent with the last handler used for it right away, so that a series of
+    requests to the same server only goes through one challenge. Credentials are cached for
+    ``MEHO_CREDENTIALS_TTL`` seconds, but read again as soon as a cached handler is rejected.
+    """
 
     def __init__(self, identities):
         self.identities = identities
-        self._handlers = {}
+        self._handlers = OrderedDict()
+        self._origins = OrderedDict()
+        self._credentials = {}
+        self._lock = threading.Lock()
 
     def __call__(self, request, **kwargs):
-        if request.url in self._handlers:
-            # attach an already built auth handler
-            return self._handlers[request.url](request, **kwargs)
-        else:
-            # add a hook to the request so it calls _retry_401 if it fails
-            request.register_hook('response', self._retry_401)
-            return request
+        origin = self.netloc(request.url)
+        with self._lock:
+            key = self._origins.get(origin)
+            handler = self._handlers.get(key)
+            if handler is not None:
+                self._handlers.move_to_end(key)
+                self._origins.move_to_end(origin)
+
+        if handler is not None:
+            # authenticate preemptively with the handler that succeeded last on this origin
+            request = handler(request, **kwargs)
+
+        # add a hook to the request so it calls _retry_401 if it fails
+        request.register_hook('response', self._retry_401)
+        return request
 
     def reset(self):
-        self._handlers = {}
+        with self._lock:
+            self._handlers.clear()
+            self._origins.clear()
+            self._credentials.clear()
 
     def netloc(self, name):
         netloc = urlparse.urlparse(name).netloc
@@ -46,37 +82,68 @@ class AutoAuth(AuthBase):
         if response.status_code != 401:
             return response
 
-        auth_scheme = response.headers.get('www-authenticate', '').split(' ')[0].lower()
+        challenge = response.headers.get('www-authenticate', '')
+        auth_scheme = challenge.split(' ')[0].lower()
+        realm = re.search(r'realm="([^"]*)"', challenge, re.IGNORECASE)
         origin = self.netloc(response.url)
+        key = (origin, auth_scheme, realm.group(1) if realm else None)
+
+        # a handler already cached for this challenge was just rejected, e.g. because its
+        # credentials were rotated; build it again from up-to-date credentials
+        with self._lock:
+            rejected = self._handlers.pop(key, None) is not None
+            self._origins.pop(origin, None)
+        auth = self._build_handler(origin, auth_scheme, refresh=rejected)
+
+        with self._lock:
+            self._handlers[key] = auth
+            self._handlers.move_to_end(key)
+            self._origins[origin] = key
+            self._origins.move_to_end(origin)
+            size = meho_settings.MEHO_AUTH_HANDLER_CACHE_SIZE
+            while len(self._handlers) > size:
+                self._handlers.popitem(last=False)
+            while len(self._origins) > size:
+                self._origins.popitem(last=False)
+
+        # consume content and release the original connection
+        # to allow our new request to reuse the same one
+        response.content
+        response.raw.release_conn()
+        prep = auth(response.request.copy())
+        extract_cookies_to_jar(prep._cookies, response.request, response.raw)
+        prep.prepare_cookies(prep._cookies)
+
+        _r = response.connection.send(prep, **kwargs)
+        _r.history.append(response)
+        _r.request = prep
+        return _r
+
+    def _build_handler(self, origin, auth_scheme, refresh=False):
+        identity = self._get_identity(origin, auth_scheme, refresh)
+        auth_class = meho_settings.MEHO_AUTH_BACKENDS.get(auth_scheme, None)
+        if identity and auth_class:
+            return import_by_path(auth_class)(**identity)
+        raise ImproperlyConfigured(
+            'No authentication credentials for "%(origin)s" with scheme '
+            '"%(scheme)s". Either provide credentials within the file '
+            'name or set credentials for (%(origin)s, %(scheme)s).' % {
+                'origin': origin,
+                'scheme': auth_scheme
+            })
+
+    def _get_identity(self, origin, auth_scheme, refresh=False):
+        key = (origin, auth_scheme)
+        with self._lock:
+            cached = self._credentials.get(key)
+        if not refresh and cached is not None and cached[0] > time.time():
+            return cached[1]
 
         try:
             identity = self.identities.get(scheme=auth_scheme, origin=origin).data
         except Credentials.DoesNotExist:
             identity = None
 
-        auth_class = meho_settings.MEHO_AUTH_BACKENDS.get(auth_scheme, None)
-        if identity and auth_class:
-            # set authentication handler for requested url
-            auth = import_by_path(auth_class)(**identity)
-            self._handlers[response.url] = auth
-
-            # consume content and release the original connection
-            # to allow our new request to reuse the same one
-            response.content
-            response.raw.release_conn()
-            prep = auth(response.request.copy())
-            extract_cookies_to_jar(prep._cookies, response.request, response.raw)
-            prep.prepare_cookies(prep._cookies)
-
-            _r = response.connection.send(prep, **kwargs)
-            _r.history.append(response)
-            _r.request = prep
-            return _r
-        else:
-            raise ImproperlyConfigured(
-                'No authentication credentials for "%(origin)s" with scheme '
-                '"%(scheme)s". Either provide credentials within the file '
-                'name or set credentials for (%(origin)s, %(scheme)s).' % {
-                    'origin': origin,
-                    'scheme': auth_scheme
-                })
\ No newline at end of file
+        with self._lock:
+            self._credentials[key] = (time.time() + meho_settings.MEHO_CREDENTIALS_TTL, identity)
+        return identity
@@ -15,26 +15,93 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import base64
 
-from django.contrib.auth import authenticate
+import base64, binascii, collections
+import hashlib, hmac, threading, time
+import meho.settings as meho_settings
+
+from django.conf import settings
+from django.contrib.auth import authenticate, get_user_model
 from django.http import HttpResponse
+from meho.models import ApiToken
+
+# verified credentials, mapping their digest to their expiry, the primary key of their user and
+# the digest of the password hash it had
+_verified = collections.OrderedDict()
+_verified_lock = threading.Lock()
 
 def basic_http_auth(realm=''):
+    """
+    Decorates views requiring authenticated requests, calling them with the authenticated user
+    as second argument.
+
+    Requests are authenticated with the ``Basic`` scheme, or with the ``Token`` scheme and the
+    key of an ``ApiToken``. Since password hashers are deliberately slow, verified basic
+    credentials are remembered for ``MEHO_API_AUTH_CACHE_TTL`` seconds; they're forgotten as
+    soon as the password of their user changes or their user is deactivated.
+    """
     def wrap(f):
         def wrapped(request, *args, **kwargs):
-            if request.META.get('HTTP_AUTHORIZATION', False):
-                auth_type, auth = request.META['HTTP_AUTHORIZATION'].split(' ')
-                auth = base64.b64decode(auth)
-                username, password = auth.decode('utf-8').split(':')
-
-                # try to authenticate the user
-                user = authenticate(username=username, password=password)
-                if user is not None:
-                    return f(request, user, *args, **kwargs)
+            user = None
+            try:
+                auth_type, auth = request.META['HTTP_AUTHORIZATION'].split(' ', 1)
+                if auth_type.lower() == 'basic':
+                    user = authenticate_basic(auth.strip())
+                elif auth_type.lower() == 'token':
+                    user = ApiToken.authenticate(auth.strip())
+            except (KeyError, ValueError):
+                pass
+            if user is not None:
+                return f(request, user, *args, **kwargs)
 
             response = HttpResponse('Authentication required', status=401)
             response['WWW-Authenticate'] = 'Basic realm=%s' % realm
             return response
         return wrapped
     return wrap
+
+def authenticate_basic(auth):
+    """
+    Returns the user authenticated by the credentials of a ``Basic`` authorization header, or
+    ``None``. Raises ``ValueError`` if ``auth`` is malformed.
+    """
+    key = _digest(auth)
+    now = time.time()
+    with _verified_lock:
+        entry = _verified.get(key)
+        if entry is not None:
+            _verified.move_to_end(key)
+
+    if entry is not None and entry[0] > now:
+        try:
+            user = get_user_model().objects.get(pk=entry[1])
+        except get_user_model().DoesNotExist:
+            user = None
+        if user is not None and user.is_active and \
+                hmac.compare_digest(_digest(user.password), entry[2]):
+            return user
+
+    try:
+        username, password = base64.b64decode(auth).decode('utf-8').split(':', 1)
+    except (binascii.Error, UnicodeDecodeError):
+        raise ValueError('Malformed basic credentials.')
+
+    user = authenticate(username=username, password=password)
+    if user is not None and not user.is_active:
+        # authentication backends of older versions of django don't reject inactive users
+        user = None
+    with _verified_lock:
+        if user is None:
+            _verified.pop(key, None)
+        else:
+            _verified[key] = (now + meho_settings.MEHO_API_AUTH_CACHE_TTL, user.pk,
+                _digest(user.password))
+            _verified.move_to_end(key)
+            while len(_verified) > meho_settings.MEHO_API_AUTH_CACHE_SIZE:
+                _verified.popitem(last=False)
+    return user
+
+def _digest(value):
+    # credentials and password hashes are never kept in memory as such
+    return hmac.new(settings.SECRET_KEY.encode('utf-8'), value.encode('utf-8'),
+        hashlib.sha256).hexdigest()
@@ -17,8 +17,11 @@
 
 import importlib
 
+from meho.core.encoders.chunked import ChunkedFFmpeg
 from meho.core.encoders.copy import Copy
 from meho.core.encoders.ffmpeg import FFmpeg
+from meho.core.encoders.segmented import SegmentedFFmpeg
+from meho.core.encoders.thumbnails import Thumbnails
 
 def load_encoder(encoder_name):
     module_name, class_name = encoder_name.rsplit('.', 1)
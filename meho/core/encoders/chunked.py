@@ -0,0 +1,266 @@
+# This source file is part of django-meho
+# Main Developer : Dimitri Racordon (kyouko.taiga@gmail.com)
+#
+# Copyright 2013 Dimitri Racordon
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json, logging, os, shlex
+import shutil, tempfile, threading, time
+import meho.settings as meho_settings
+
+from datetime import datetime
+from subprocess import Popen, PIPE
+from meho.core.encoders.ffmpeg import FFmpeg, sample_position
+from meho.core.progress import get_reporter, report_progress
+from meho.core.volumes import get_volume
+
+logger = logging.getLogger('meho')
+
+class ChunkedFFmpeg(FFmpeg):
+    """
+    A ffmpeg encoder that splits long inputs into segments starting on keyframes, encodes the
+    segments in parallel processes and losslessly concatenates the results.
+
+    Inputs are split into ``MEHO_CHUNKED_SEGMENTS`` segments, which defaults to the number of
+    CPUs per job running on the worker pool (e.g. 4 with 16 CPUs and 4 running jobs), so that
+    long inputs use the CPUs left idle by a lightly loaded pool. Inputs shorter than ``MEHO_CHUNKED_MIN_DURATION``
+    seconds, or without enough keyframes to be split, are transcoded by a single ffmpeg process
+    as with ``FFmpeg``.
+
+    .. note:: Segments are encoded independently, so encoder strings relying on the whole input
+       (e.g. two-pass encoding) shouldn't be used with this encoder.
+    """
+
+    def transcode_many(self, media_in, outputs):
+        # each output is encoded separately since segments are already run in parallel
+        task_ids = []
+        for output in outputs:
+            task_ids += self._transcode_chunked(media_in, *output)
+        return task_ids
+
+    def _transcode_chunked(self, media_in, media_out, encoder_string, task_id):
+        volume = get_volume(media_in.private_url)
+
+        input_file, temporary_input = self._input_file(media_in, volume)
+        try:
+            from meho.core.probe import probe_media # avoid circular import
+            input_info = probe_media(media_in, input_file, volume)
+
+            # segments already encoded by a previous run of this job, whose worker died, are
+            # kept in a work directory named after the task
+            work_dir = os.path.join(meho_settings.MEHO_TEMP_ROOT, 'meho-chunked-%s' % task_id)
+            state = read_state(work_dir)
+            if state is not None and (state['encoder_string'] != encoder_string or
+                    state['duration'] != input_info['duration']):
+                state = None
+
+            if state is None:
+                segments = self._split_points(input_file, input_info['duration'] or 0.0)
+                if len(segments) < 2:
+                    output_info = {'outputs': [self._output(media_out, encoder_string, task_id)]}
+                    self._start_ffmpeg_task(input_file, input_info, output_info)
+                    return [task_id]
+
+                shutil.rmtree(work_dir, ignore_errors=True)
+                os.makedirs(work_dir)
+                state = {
+                    'encoder_string': encoder_string,
+                    'duration': input_info['duration'],
+                    'segments': segments,
+                    'completed': []
+                }
+                write_state(work_dir, state)
+            else:
+                logger.info('resuming chunked ffmpeg task [%s]: %i of %i segments done' % (
+                    task_id, len(state['completed']), len(state['segments'])))
+
+            from meho.core.jobs import record_job_state # avoid circular import
+            record_job_state([task_id], work_path=work_dir)
+
+            output_info = {'outputs': [self._output(media_out, encoder_string, task_id)]}
+            try:
+                with tempfile.TemporaryFile() as stderr_file:
+                    output_info['stderr'] = stderr_file
+                    status_code = self._encode_segments(
+                        input_file, input_info, state, output_info, work_dir)
+                    if status_code == 0:
+                        status_code = self._concat_segments(output_info, work_dir)
+                    self._handle_ffmpeg_complete(status_code, output_info)
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+        finally:
+            if temporary_input:
+                os.remove(input_file)
+
+        return [task_id]
+
+    def _split_points(self, input_file, duration):
+        """
+        Returns a list of ``(start, duration)`` pairs describing the segments ``input_file``
+        should be split into; segments start on keyframes of the first video stream.
+        """
+        count = meho_settings.MEHO_CHUNKED_SEGMENTS
+        if not count:
+            # segments are encoded concurrently with the other jobs running on the pool
+            from meho.core.workers import current_worker_pool # avoid circular import
+            pool = current_worker_pool()
+            running = pool.stats()['running'] if pool is not None else 1
+            count = (os.cpu_count() or 1) // max(running, 1)
+        if count < 2 or duration < meho_settings.MEHO_CHUNKED_MIN_DURATION:
+            return [(0.0, duration)]
+
+        keyframes = parse_keyframes(input_file)
+        starts = [0.0]
+        for i in range(1, count):
+            target = duration * i / count
+            # pick the first keyframe following the ideal split point
+            candidates = [t for t in keyframes if t >= target and t > starts[-1]]
+            if candidates:
+                starts.append(candidates[0])
+
+        ends = starts[1:] + [duration]
+        return [(start, end - start) for start, end in zip(starts, ends) if end > start]
+
+    def _encode_segments(self, input_file, input_info, state, output_info, work_dir):
+        """
+        Encodes the segments of ``input_file`` described by ``state`` in parallel, skipping the
+        segments already completed; returns 0 if all segments were encoded successfully.
+
+        Completed segments are recorded in ``state``, which is saved to ``work_dir`` as soon as
+        a segment is done so that the task can be resumed if the worker dies.
+        """
+        segments = state['segments']
+        completed = set(state['completed'])
+        state_lock = threading.Lock()
+
+        output = output_info['outputs'][0]
+        output['status'] = get_reporter().get(output['task_id']) or {}
+        output['status'].update({'status': 'running', 'eta': 0, 'progress': 0})
+        report_progress(output['task_id'], output['status'])
+
+        start_time = datetime.now()
+        input_duration = input_info['duration'] or 0.0
+        positions = [length if index in completed else 0.0
+            for index, (start, length) in enumerate(segments)]
+        suffix = os.path.splitext(output['filename'])[1]
+
+        def progress_handler(index):
+            def on_progress(sample):
+                position = sample_position(sample)
+                if position is None:
+                    return
+                if min(position, segments[index][1]) > positions[index]:
+                    # samples are written periodically even if ffmpeg is stuck
+                    output_info['progressed_at'] = time.time()
+                positions[index] = min(position, segments[index][1])
+
+                # aggregate the progress of all segments
+                try:
+                    ratio = min(sum(positions) / input_duration, 1.0)
+                except ZeroDivisionError:
+                    ratio = 1.0
+                elapsed_time = datetime.now() - start_time
+                try:
+                    eta_time = int(elapsed_time.total_seconds() * (1.0 - ratio) / ratio)
+                except ZeroDivisionError:
+                    eta_time = 0
+
+                output['status'].update({'eta': eta_time, 'progress': ratio * 100})
+                report_progress(output['task_id'], output['status'])
+            return on_progress
+
+        def completion_handler(index):
+            def on_done(future):
+                if future.cancelled() or future.exception() is not None or future.result() != 0:
+                    return
+                with state_lock:
+                    state['completed'].append(index)
+                    write_state(work_dir, state)
+            return on_done
+
+        futures = {}
+        output['segments'] = []
+        for index, (start, length) in enumerate(segments):
+            segment_file = os.path.join(work_dir, 'segment%05i%s' % (index, suffix))
+            output['segments'].append(segment_file)
+            if index in completed and os.path.exists(segment_file):
+                continue
+
+            args = ['ffmpeg', '-y', '-nostats', '-ss', '%.6f' % start, '-i', input_file,
+                '-t', '%.6f' % length]
+            args += shlex.split(output['encoder_string']) + [segment_file]
+
+            logger.info('starting ffmpeg task [%s] segment %i: %s' % (
+                output['task_id'], index, ' '.join(args)))
+            key = '%s.%i' % (output['task_id'], index)
+            futures[key] = self._submit(key, args, output_info,
+                on_progress=progress_handler(index))
+            futures[key].add_done_callback(completion_handler(index))
+
+        # the first failing segment stops the others since the output can't be completed anymore
+        return self._wait(futures, output_info)
+
+    def _concat_segments(self, output_info, work_dir):
+        """Concatenates the encoded segments into the output file without re-encoding them."""
+        output = output_info['outputs'][0]
+        list_file = os.path.join(work_dir, 'segments.txt')
+        with open(list_file, 'w') as f:
+            for segment_file in output['segments']:
+                f.write("file '%s'\n" % segment_file.replace("'", "'\\''"))
+
+        args = ['ffmpeg', '-y', '-nostats', '-f', 'concat', '-safe', '0',
+            '-i', list_file, '-c', 'copy', output['filename']]
+        last_position = [None]
+
+        def on_progress(sample):
+            position = sample_position(sample)
+            if position is not None and (last_position[0] is None or position > last_position[0]):
+                output_info['progressed_at'] = time.time()
+                last_position[0] = position
+
+        output_info['progressed_at'] = time.time()
+        future = self._submit(output['task_id'], args, output_info, on_progress=on_progress)
+        return self._wait({output['task_id']: future}, output_info)
+
+def parse_keyframes(filename):
+    """Returns the timestamps (in seconds) of the keyframes of the first video stream."""
+    cmd = ('ffprobe -v error -select_streams v:0 -show_entries packet=pts_time,flags '
+        '-of csv=print_section=0 "%s"' % filename)
+    p = Popen(shlex.split(cmd), stdout=PIPE, stderr=PIPE, close_fds=True, shell=False)
+    stdout, stderr = p.communicate()
+
+    keyframes = []
+    for line in stdout.decode('utf-8').splitlines():
+        pts_time, _, flags = line.partition(',')
+        if 'K' in flags:
+            try:
+                keyframes.append(float(pts_time))
+            except ValueError:
+                pass
+    return sorted(keyframes)
+
+def read_state(work_dir):
+    """Returns the state saved in ``work_dir`` by ``write_state``, or ``None``."""
+    try:
+        with open(os.path.join(work_dir, 'state.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_state(work_dir, state):
+    """Atomically saves ``state`` to ``work_dir``."""
+    filename = os.path.join(work_dir, 'state.json')
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(filename + '.tmp', filename)
@@ -15,16 +15,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from meho.core.volumes import VolumeSelector, TemporaryVolumeDriver
+from meho.core.volumes import get_volume
 
 class Copy(object):
 
-    def transcode(self, media_in, media_out, encoder_string=''):
+    def transcode(self, media_in, media_out, encoder_string='', task_id=None):
         # get file locators for input/output media
-        selector   = VolumeSelector()
-        volume_in  = selector.backend_for(selector.scheme(media_in.private_url))()
-        volume_out = selector.backend_for(selector.scheme(media_out.private_url))()
+        volume_in  = get_volume(media_in.private_url)
+        volume_out = get_volume(media_out.private_url)
 
         # copy input file into output
         with volume_in.open(media_in.private_url, 'rb') as i:
             volume_out.save(media_out.private_url, i)
+
+        media_out.status = 'ready'
+        media_out.save()
+        return task_id
@@ -16,167 +16,387 @@
 # limitations under the License.
 
 import json, logging, re
-import fcntl, os, select, shlex, shutil, threading
-import tempfile
+import os, shlex, shutil
+import tempfile, threading, time, uuid
+import meho.settings as meho_settings
 
+from concurrent.futures import CancelledError, wait
 from datetime import datetime
-from django.core.cache import cache
 from subprocess import Popen, PIPE
-from meho.core.volumes import VolumeSelector, TemporaryVolumeDriver
+from meho.core.encoders.supervisor import get_supervisor
+from meho.core.progress import get_reporter, report_progress
+from meho.core.volumes import get_volume
+from meho.core.volumes.filesystem import copy_fileobj
 
 logger = logging.getLogger('meho')
 
 class FFmpeg(object):
 
-    def transcode(self, media_in, media_out, encoder_string=''):
+    def __init__(self, limits=None):
+        """
+        ``limits`` is a dictionary of limits applied to the ffmpeg processes of this encoder:
+        ``timeout`` (maximum wall time in seconds), ``stall_timeout`` (maximum number of seconds
+        without progress, defaults to ``MEHO_FFMPEG_STALL_TIMEOUT``), ``nice``, ``cpu_affinity``
+        and ``memory`` (see ``FFmpegSupervisor.submit``).
+        """
+        self.limits = limits or {}
+
+    def transcode(self, media_in, media_out, encoder_string='', task_id=None):
         """
         Transcodes ``media_in`` using ffmpeg with the profile specified by ``encoder_string``
         and saves the transcoded media to the private url of ``media_out``.
 
-        This method is asynchronous and only returns the task identifier. Current progress status
-        can be obtained with the tasks api.
+        This method blocks until ffmpeg exits and returns the task identifier under which the
+        progress status was reported; current progress status can be obtained with the tasks api.
+        Use ``meho.core.jobs.enqueue_job`` to run it on a worker.
 
         .. note:: Transcoding relies on both ``ffmpeg`` and ``ffprobe`` binaries; those should be
            available by the ``PATH`` variable.
         """
+        if task_id is None:
+            task_id = 'task_ffmpeg_{0}'.format(uuid.uuid4().hex)
+        return self.transcode_many(media_in, [(media_out, encoder_string, task_id)])[0]
+
+    def transcode_many(self, media_in, outputs):
+        """
+        Transcodes ``media_in`` into several outputs with a single ffmpeg process, so that the
+        input is read and decoded only once. ``outputs`` is a list of ``(media_out,
+        encoder_string, task_id)`` tuples; each output gets its own status and task.
+
+        This method blocks until ffmpeg exits and returns the list of task identifiers.
+        """
+        outputs = [(media_out, encoder_string, task_id or 'task_ffmpeg_{0}'.format(
+            uuid.uuid4().hex)) for media_out, encoder_string, task_id in outputs]
+
         # get file locators for input/output media
-        selector = VolumeSelector()
-        volume = selector.backend_for(selector.scheme(media_in.private_url))()
+        volume = get_volume(media_in.private_url)
+
+        # retrieves input media information, probing the input file only if it has changed
+        # since the last time it was probed
+        from meho.core.probe import probe_media # avoid circular import
+        input_info = None
+        if meho_settings.MEHO_FFMPEG_STREAMING:
+            # the input can only be streamed if its format is already known
+            input_info = probe_media(media_in, volume=volume, cached_only=True)
 
+        input_file, temporary_input = self._input_file(media_in, volume, input_info)
+        try:
+            if input_info is None:
+                input_info = probe_media(media_in, input_file, volume)
+
+            # ffmpeg has a single stdout, hence only a lone output can be streamed
+            output_info = {'outputs': [self._output(media_out, encoder_string, task_id,
+                    stream=len(outputs) == 1)
+                for media_out, encoder_string, task_id in outputs]}
+            if input_file == 'pipe:0':
+                output_info['input'] = (volume, media_in.private_url)
+            self._start_ffmpeg_task(input_file, input_info, output_info)
+        finally:
+            if temporary_input:
+                os.remove(input_file)
+
+        return [task_id for media_out, encoder_string, task_id in outputs]
+
+    def _input_file(self, media_in, volume, input_info=None):
+        """
+        Returns a location ffmpeg can read ``media_in`` from, and whether it's a temporary copy
+        that should be removed once the task is done.
+
+        If ``input_info`` is provided and describes a streamable format, inputs that aren't
+        reachable through a path are streamed to ffmpeg's stdin, rather than read by ffmpeg from
+        their url or copied to a temporary file; the location is then ``pipe:0``.
+        """
         try:
             # try to access input file from absolute path
-            input_file = volume.path(media_in.private_url)
+            return volume.path(media_in.private_url), False
         except NotImplementedError:
-            try:
-                # try to access input file from url 
-                input_file = 'cache:' + volume.url(media_in.private_url)
-            except NotImplementedError:
-                # since we can't user neither path nor url, we'll
-                # copy the input file to a local temporary file
-                with volume.open(media_in.private_url) as f:
-                    input_file = self._local_copy(f)
-
-        # write the output file to a temporary file
-        _, output_file = tempfile.mkstemp()
+            pass
 
-        # start ffmpeg task
-        return self._start_ffmpeg_task(input_file, output_file, encoder_string, media_out)
+        if input_info is not None and is_streamable(input_info['format']):
+            # reading through the volume keeps its authentication, which ffmpeg can't do itself
+            return 'pipe:0', False
 
-    def _start_ffmpeg_task(self, input_file, output_file, encoder_string, media_out):
-        """Starts a new ffmpeg task; returns the pid of the spawned process.
+        try:
+            # try to access input file from url 
+            return 'cache:' + volume.url(media_in.private_url), False
+        except NotImplementedError:
+            pass
 
-        .. warning:: This method spawns a new thread when called, possibly ending up using all
-           system resources in case of high load due to normal traffic or trivial DoS attack.
+        # since we can't user neither path nor url, we'll
+        # copy the input file to a local temporary file
+        with volume.open(media_in.private_url) as f:
+            return self._local_copy(f), True
 
-           Consider replacing the spawning of a new thread by a task queue manager.
+    def _output(self, media_out, encoder_string, task_id, stream=False):
         """
-        # retrieves input media information
-        input_info = parse_ffprobe(input_file)
-        output_info = {'filename': output_file, 'media': media_out}
+        Returns the description of an output of a ffmpeg task. The output is written to a
+        temporary file, keeping the extension of the private url of ``media_out`` so that ffmpeg
+        can guess the output format.
 
-        # generate ffmpeg command
-        cmd = 'ffmpeg -y -i "%s" %s "%s"' % (input_file, encoder_string, output_file)
+        If ``stream`` is set and ``MEHO_FFMPEG_STREAMING`` is enabled, outputs in a streamable
+        format that can't be written through a path are instead piped from ffmpeg's stdout to
+        the volume of ``media_out`` while ffmpeg runs.
+        """
+        volume = get_volume(media_out.private_url)
+        suffix = os.path.splitext(volume.filename(media_out.private_url))[1]
+        output = {
+            'task_id': task_id,
+            'media': media_out,
+            'encoder_string': encoder_string
+        }
+
+        if stream and meho_settings.MEHO_FFMPEG_STREAMING:
+            output_format = guess_output_format(encoder_string, suffix)
+            try:
+                # local copies of cached volumes can't be written to
+                writable = not volume.cached_paths and bool(volume.path(media_out.private_url))
+            except NotImplementedError:
+                writable = False
+            if not writable and is_streamable(output_format, encoder_string):
+                output['filename'] = 'pipe:1'
+                output['format'] = output_format
+                output['volume'] = volume
+                return output
+
+        fd, output['filename'] = tempfile.mkstemp(suffix=suffix)
+        os.close(fd)
+        return output
+
+    def _start_ffmpeg_task(self, input_file, input_info, output_info):
+        """Starts a new ffmpeg task and waits until it exits."""
+        # generate ffmpeg command; progress is reported as key=value lines on stdout while
+        # diagnostics are kept aside in a temporary file, so that no pipe can fill up
+        args = ['ffmpeg', '-y', '-nostats'] + self._input_args(input_info) + ['-i', input_file]
+        for output in output_info['outputs']:
+            args += self._output_args(output) + [output['filename']]
+
+        task_ids = ', '.join(output['task_id'] for output in output_info['outputs'])
+        logger.info('starting ffmpeg task [%s]: %s' % (task_ids, ' '.join(args)))
+
+        # record temporary outputs so that they can be cleaned up if the worker dies
+        from meho.core.jobs import record_job_state # avoid circular import
+        for output in output_info['outputs']:
+            if 'volume' not in output:
+                record_job_state([output['task_id']],
+                    work_path=output.get('work_dir', output['filename']))
+
+        with tempfile.TemporaryFile() as stderr_file:
+            output_info['stderr'] = stderr_file
+            self._handle_ffmpeg_task(args, input_info, output_info)
+
+    def _input_args(self, input_info):
+        """Returns the ffmpeg arguments applying to the input, described by ``input_info``."""
+        return []
+
+    def _output_args(self, output):
+        """Returns the ffmpeg arguments applying to ``output``, but its filename."""
+        output_args = shlex.split(output['encoder_string'])
+        if 'volume' in output and '-f' not in output_args:
+            # ffmpeg can't guess the format of a pipe
+            output_args += ['-f', output['format']]
+        return output_args
+
+    def _handle_ffmpeg_task(self, ffmpeg_args, input_info, output_info):
+        """Handles the execution of a ffmpeg task.
 
-        # run ffmpeg in a new thread
-        p = Popen(shlex.split(cmd), stderr=PIPE, close_fds=True, shell=False)
-        t = threading.Thread(target=self._handle_ffmpeg_task, args=[p, input_info, output_info])
-        t.setDaemon(True)
-        t.start()
+        The process is run by the ffmpeg supervisor, which parses the progress stream ffmpeg
+        writes with ``-progress`` on its event loop; this method only blocks the calling worker
+        until the process exits, then calls ``_handle_ffmpeg_complete``.
+        """
+        outputs = output_info['outputs']
+        for output in outputs:
+            # keep the queueing information set by the job runner
+            output['status'] = get_reporter().get(output['task_id']) or {}
+            output['status'].update({'status': 'running', 'eta': 0, 'progress': 0})
+            report_progress(output['task_id'], output['status'])
+
+        start_time = datetime.now()
+        input_duration = input_info['duration'] or 0.0
+
+        last_position = [None]
+
+        def on_progress(sample):
+            position = sample_position(sample)
+            if position is None:
+                return
+            if last_position[0] is None or position > last_position[0]:
+                # samples are written periodically even if ffmpeg is stuck
+                output_info['progressed_at'] = time.time()
+                last_position[0] = position
 
-        logger.info('started ffmpeg job [%i]: %s' % (p.pid, cmd))
-        return 'task_ffmpeg_{0}'.format(p.pid)
+            try:
+                ratio = position / input_duration
+                ratio = 0.0 if ratio < 0.0 else 1.0 if ratio > 1.0 else ratio
+            except ZeroDivisionError:
+                ratio = 1.0
 
-    def _handle_ffmpeg_task(self, ffmpeg_proc, input_info, output_info):
-        """Handles the execution of a ffmpeg task.
-        
-        The logic of this function is mostly based on OSCIED (https://github.com/ebu/OSCIED) for
-        parsing ffmpeg output and update encoding progress.
-        """
+            elapsed_time = datetime.now() - start_time
+            try:
+                eta_time = int(elapsed_time.total_seconds() * (1.0 - ratio) / ratio)
+            except ZeroDivisionError:
+                eta_time = 0
 
-        # frame= 2071 fps=  0 q=-1.0 size=   34623kB time=00:01:25.89 bitrate=3302.3kbits/s
-        FFMPEG_REGEX = re.compile(
-            r'frame=\s*(?P<frame>\d+)\s+fps=\s*(?P<fps>\d+)\s+q=\s*(?P<q>\S+)\s+\S*'
-            r'size=\s*(?P<size>\S+)\s+time=\s*(?P<time>\S+)\s+bitrate=\s*(?P<bitrate>\S+)')
+            # update process status; all outputs progress at the same pace
+            for output in outputs:
+                output['status'].update({'eta': eta_time, 'progress': ratio * 100})
+                report_progress(output['task_id'], output['status'])
 
-        # update transcoding status every 0.1 second(s)
-        UPDATE_TIME_DELTA = 0.1
+        stdin, stdout, transfers = self._start_transfers(output_info)
+        status_code = -1
+        try:
+            future = self._submit(outputs[0]['task_id'], ffmpeg_args, output_info,
+                on_progress=on_progress, stdin=stdin, stdout=stdout)
+            status_code = self._wait({outputs[0]['task_id']: future}, output_info)
+        except BaseException:
+            get_supervisor().cancel(outputs[0]['task_id'])
+            raise
+        finally:
+            # wait for streamed data to be fully transferred, even if ffmpeg failed to start, so
+            # that partial outputs are deleted by the handler
+            for transfer in transfers:
+                transfer.join()
+                if transfer.error is not None and status_code == 0:
+                    logger.error('transfer of ffmpeg task [%s] failed: %s' % (
+                        outputs[0]['task_id'], transfer.error))
+                    status_code = -1
+
+            # call handler for ffmpeg task termination
+            self._handle_ffmpeg_complete(status_code, output_info)
+
+    def _submit(self, key, ffmpeg_args, output_info, **kwargs):
+        """
+        Submits a ffmpeg process to the supervisor under ``key``, applying the limits of this
+        encoder; returns its future.
+        """
+        output_info.setdefault('progressed_at', time.time())
+        return get_supervisor().submit(key, ffmpeg_args, stderr=output_info['stderr'],
+            timeout=self.limits.get('timeout'), limits=self.limits, **kwargs)
 
-        cache.set('task_ffmpeg_{0}'.format(ffmpeg_proc.pid), {
-            'eta': 0,
-            'progress': 0
-        })
+    def _wait(self, futures, output_info):
+        """
+        Waits for the ffmpeg processes of ``futures`` (a dictionary mapping supervisor keys to
+        futures) to exit, and returns 0 if all of them succeeded or the first failing status.
 
-        previous_time = start_time = datetime.now()
-        input_duration = float(input_info['format']['duration'])
+        All processes are killed as soon as one of them fails, one of the tasks of
+        ``output_info`` is cancelled, or no progress was reported for ``stall_timeout`` seconds.
+        """
+        from meho.core.jobs import is_cancelled # avoid circular import
 
-        # Add the O_NONBLOCK flag to stderr file descriptor.
-        # http://stackoverflow.com/a/7730201/190597
-        fcntl.fcntl(ffmpeg_proc.stderr, fcntl.F_SETFL,
-            fcntl.fcntl(ffmpeg_proc.stderr, fcntl.F_GETFL) | os.O_NONBLOCK)
+        task_ids = [output['task_id'] for output in output_info['outputs']]
+        stall_timeout = self.limits.get('stall_timeout', meho_settings.MEHO_FFMPEG_STALL_TIMEOUT)
+        aborted = False
 
         while True:
-            # wait for data to be available
-            select.select([ffmpeg_proc.stderr], [], [])
-            chunk = ffmpeg_proc.stderr.read()
-            elapsed_time = datetime.now() - start_time
-
-            # parse ffmpeg output to compute progress status
-            match = FFMPEG_REGEX.match(chunk.decode('utf-8'))
-            if match:
-                ffmpeg_output = match.groupdict()
-                try:
-                    ratio = total_seconds(ffmpeg_output['time']) / float(input_duration)
-                    ratio = 0.0 if ratio < 0.0 else 1.0 if ratio > 1.0 else ratio
-                except ZeroDivisionError:
-                    ratio = 1.0
-
-                delta = (datetime.now() - previous_time).total_seconds()
-                if delta >= UPDATE_TIME_DELTA:
-                    previous_time = datetime.now()
-                    try:
-                        eta_time = int(elapsed_time.total_seconds() * (1.0 - ratio) / ratio)
-                    except ZeroDivisionError:
-                        eta_time = 0
-
-                    # update process status
-                    cache.set('task_ffmpeg_{0}'.format(ffmpeg_proc.pid), {
-                        'eta': eta_time,
-                        'progress' : ratio * 100
-                    })
-
-            # check for ffmpeg task termination
-            if ffmpeg_proc.poll() is not None:
+            done, pending = wait(futures.values(), timeout=meho_settings.MEHO_CANCEL_POLL_INTERVAL)
+            if not pending:
                 break
+            if aborted:
+                continue
+
+            if any(f.cancelled() or f.exception() is not None or f.result() != 0 for f in done):
+                reason = 'a process failed'
+            elif is_cancelled(task_ids):
+                reason = 'cancelled'
+            elif stall_timeout and time.time() - output_info['progressed_at'] > stall_timeout:
+                reason = 'no progress for %i seconds' % stall_timeout
+            else:
+                continue
+
+            logger.warning('aborting ffmpeg task [%s]: %s' % (', '.join(task_ids), reason))
+            for key in futures:
+                get_supervisor().cancel(key)
+            aborted = True
+
+        status_code = 0
+        for future in futures.values():
+            try:
+                result = future.result()
+            except (CancelledError, OSError):
+                # the process was killed before it started, or could not be started at all
+                result = -1
+            if result != 0 and status_code == 0:
+                status_code = result
+        return status_code
+
+    def _start_transfers(self, output_info):
+        """
+        Starts the threads streaming the input to ffmpeg's stdin and its stdout to the output
+        volume, if any; returns the file descriptors to pass as stdin and stdout of ffmpeg along
+        with the started transfers.
+        """
+        stdin, stdout, transfers = None, None, []
+        if 'input' in output_info:
+            volume, name = output_info['input']
+            stdin, pipe_in = os.pipe()
 
-        # call handler for ffmpeg task termination
-        self._handle_ffmpeg_complete(ffmpeg_proc, output_info)
-
-    def _handle_ffmpeg_complete(self, ffmpeg_proc, output_info):
+            def feed():
+                with open(pipe_in, 'wb') as dst, volume.open(name, 'rb') as src:
+                    try:
+                        shutil.copyfileobj(src, dst, 1048576)
+                    except BrokenPipeError:
+                        # ffmpeg stopped reading, e.g. because it failed
+                        pass
+            transfers.append(Transfer(feed))
+
+        for output in output_info['outputs']:
+            if 'volume' in output:
+                pipe_out, stdout = os.pipe()
+
+                def drain(output=output):
+                    with open(pipe_out, 'rb') as src:
+                        output['volume'].save(output['media'].private_url, src)
+                transfers.append(Transfer(drain))
+
+        for transfer in transfers:
+            transfer.start()
+        return stdin, stdout, transfers
+
+    def _handle_ffmpeg_complete(self, status_code, output_info):
         """
         Handles the termination of a ffmpeg task.
         """
-        status_code = ffmpeg_proc.poll()
-        if status_code == 0:
-            # copy the transcoded file to the output media's private_url
-            private_url = output_info['media'].private_url
-            selector = VolumeSelector()
-            volume = selector.backend_for(selector.scheme(private_url))()
-            try:
-                os.rename(output_info['filename'], volume(private_url).path)
-            except NotImplementedError:
-                with open(output_info['filename'], 'rb') as f:
-                    volume.save(private_url, f)
-            output_info['media'].status = 'ready'
-        else:
-            output_info['media'].status = 'failed'
-        output_info['media'].save()
-
-        cache.set('task_ffmpeg_{0}'.format(ffmpeg_proc.pid), {
-            'eta': 0,
-            'progress' : 100
-        })
-
-        logger.info('ffmpeg job [%i] exited with status %i' % (ffmpeg_proc.pid, status_code))
+        outputs = output_info['outputs']
+        task_ids = ', '.join(output['task_id'] for output in outputs)
+
+        if status_code != 0 and 'stderr' in output_info:
+            output_info['stderr'].seek(0)
+            diagnostics = output_info['stderr'].read()[-2048:].decode('utf-8', 'replace')
+            logger.error('ffmpeg task [%s] failed:\n%s' % (task_ids, diagnostics))
+
+        for output in outputs:
+            media = output['media']
+            if 'volume' in output:
+                # the output was streamed straight to its volume
+                media.status = 'ready' if status_code == 0 else 'failed'
+                if status_code != 0:
+                    try:
+                        output['volume'].delete(media.private_url)
+                    except Exception:
+                        logger.exception('could not delete partial output %s' % media)
+            elif status_code == 0:
+                # copy the transcoded file to the output media's private_url
+                volume = get_volume(media.private_url)
+                try:
+                    if volume.cached_paths:
+                        raise NotImplementedError()
+                    os.rename(output['filename'], volume.path(media.private_url))
+                except (NotImplementedError, OSError):
+                    # the volume isn't local, or the file can't be renamed there (e.g. because
+                    # it's on another filesystem); let the volume copy it
+                    with open(output['filename'], 'rb') as f:
+                        volume.save(media.private_url, f)
+                    os.remove(output['filename'])
+                media.status = 'ready'
+            else:
+                media.status = 'failed'
+                if os.path.exists(output['filename']):
+                    os.remove(output['filename'])
+            media.save()
+
+            output['status'].update({'status': media.status, 'eta': 0, 'progress': 100})
+            report_progress(output['task_id'], output['status'])
+
+        logger.info('ffmpeg task [%s] exited with status %i' % (task_ids, status_code))
 
     def _local_copy(self, content):
         """
@@ -185,15 +405,124 @@ class FFmpeg(object):
         """
         (fd, tmp_name) = tempfile.mkstemp()
         with open(fd, 'wb') as tmp_file:
-            shutil.copyfileobj(content, tmp_file)
-        return tmp_name    
+            copy_fileobj(content, tmp_file)
+        return tmp_name
+
+class Transfer(threading.Thread):
+    """A thread copying data between a volume and a pipe, remembering why it failed if it did."""
+
+    def __init__(self, target):
+        super(Transfer, self).__init__(name='meho-ffmpeg-transfer')
+        self.setDaemon(True)
+        self.error = None
+        self._transfer = target
+
+    def run(self):
+        try:
+            self._transfer()
+        except Exception as e:
+            self.error = e
+
+# container formats that can be read or written sequentially, without seeking
+STREAMABLE_FORMATS = ('mpegts', 'matroska', 'webm', 'flv', 'ogg', 'mp3', 'adts', 'nut', 'wav')
+
+# container formats that can only be written sequentially when fragmented
+FRAGMENTABLE_FORMATS = ('mp4', 'mov', 'ismv')
+
+# formats guessed from file extensions, for outputs written on pipes
+FORMAT_EXTENSIONS = {
+    '.ts': 'mpegts', '.mkv': 'matroska', '.webm': 'webm', '.flv': 'flv', '.ogg': 'ogg',
+    '.ogv': 'ogg', '.oga': 'ogg', '.mp3': 'mp3', '.aac': 'adts', '.nut': 'nut', '.wav': 'wav',
+    '.mp4': 'mp4', '.m4v': 'mp4', '.m4a': 'mp4', '.mov': 'mov', '.ismv': 'ismv'
+}
+
+def guess_output_format(encoder_string, suffix):
+    """
+    Returns the output format set with ``-f`` in ``encoder_string``, or guessed from the file
+    extension ``suffix``; returns ``None`` if the format is unknown.
+    """
+    args = shlex.split(encoder_string)
+    for i in range(len(args) - 2, -1, -1):
+        if args[i] == '-f':
+            return args[i + 1]
+    return FORMAT_EXTENSIONS.get(suffix.lower())
+
+def is_streamable(formats, encoder_string=''):
+    """
+    Returns whether ``formats`` (a comma-separated list of format names, as reported by ffprobe)
+    can be processed sequentially. Fragmentable formats are streamable if ``encoder_string``
+    enables fragmentation.
+    """
+    if not formats:
+        return False
+    for name in formats.split(','):
+        if name in STREAMABLE_FORMATS:
+            return True
+        if name in FRAGMENTABLE_FORMATS:
+            return 'frag_keyframe' in encoder_string and 'empty_moov' in encoder_string
+    return False
+
+class ProbeError(Exception):
+    """Raised when ``ffprobe`` can't read a file, e.g. because it isn't a media file."""
 
 def parse_ffprobe(filename):
     cmd = 'ffprobe -print_format json -show_format -show_streams "%s"' % filename
     p = Popen(shlex.split(cmd), stdout=PIPE, stderr=PIPE, close_fds=True, shell=False)
     stdout, stderr = p.communicate()
 
-    return json.loads(stdout.decode('utf-8'))
+    if p.returncode != 0:
+        reason = stderr.decode('utf-8', 'replace').strip().splitlines()
+        raise ProbeError('ffprobe could not read %s: %s' % (filename,
+            reason[-1] if reason else 'exit status %i' % p.returncode))
+    try:
+        return json.loads(stdout.decode('utf-8'))
+    except ValueError:
+        raise ProbeError('ffprobe returned invalid output for %s' % filename)
+
+class FFmpegProgressParser(object):
+    """
+    Incremental parser for the progress stream ffmpeg writes when run with ``-progress``.
+
+    The stream is made of ``key=value`` lines, each block of lines being terminated by a
+    ``progress=continue`` or ``progress=end`` line. Data can be fed in arbitrary chunks; lines
+    split across chunks are buffered until they are complete.
+    """
+
+    def __init__(self):
+        self._buffer = b''
+        self._sample = {}
+
+    def feed(self, data):
+        """Parses ``data`` and returns the list of samples it completed, oldest first."""
+        lines = re.split(b'[\r\n]', self._buffer + data)
+        self._buffer = lines.pop()
+
+        samples = []
+        for line in lines:
+            key, sep, value = line.decode('utf-8', 'replace').partition('=')
+            if not sep:
+                continue
+            self._sample[key.strip()] = value.strip()
+            if key.strip() == 'progress':
+                samples.append(self._sample)
+                self._sample = {}
+        return samples
+
+def sample_position(sample):
+    """
+    Returns the output position (in seconds) reported by a progress sample, or ``None`` if the
+    sample doesn't carry a usable position.
+    """
+    # despite its name, out_time_ms is expressed in microseconds
+    for key in ('out_time_us', 'out_time_ms'):
+        try:
+            return int(sample[key]) / 1000000.0
+        except (KeyError, ValueError):
+            pass
+    try:
+        return total_seconds(sample['out_time'])
+    except (KeyError, ValueError):
+        return None
 
 def total_seconds(time):
     hours, minutes, seconds = time.split(':')
@@ -0,0 +1,188 @@
+# This source file is part of django-meho
+# Main Developer : Dimitri Racordon (kyouko.taiga@gmail.com)
+#
+# Copyright 2013 Dimitri Racordon
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging, os, re, shutil, tempfile
+import meho.settings as meho_settings
+
+from django.db import transaction
+from meho.core.encoders.ffmpeg import FFmpeg
+from meho.core.volumes import get_volume
+from meho.models import Metadata
+
+logger = logging.getLogger('meho')
+
+# name of the metadata row listing the segments of a segmented media, as ranges of numbered
+# names (see ``compress_names``); lists too long for a single row are split into numbered rows
+SEGMENT_METADATA = 'rendition.segments'
+
+# maximum length of the content of a metadata row
+METADATA_LENGTH = 200
+
+# packaging formats, by extension of the manifest
+MANIFEST_FORMATS = {
+    '.m3u8': 'hls',
+    '.mpd': 'dash'
+}
+
+class SegmentedFFmpeg(FFmpeg):
+    """
+    A ffmpeg encoder packaging its outputs for adaptive streaming: the private url of each
+    output media locates a manifest, either a HLS playlist (``.m3u8``) or a DASH manifest
+    (``.mpd``), and fixed-duration segments are written next to it on the output volume.
+
+    Segments are named after the manifest (e.g. ``index_00001.ts`` for ``index.m3u8``) so that
+    several renditions can share a directory, and are listed in the metadata of the media so
+    that publishers can expose the whole rendition (see ``segment_names``). The duration of
+    segments is given by ``MEHO_SEGMENT_DURATION``; keyframes are forced at segment boundaries.
+    """
+
+    # segments can't be restored from the result cache, which only holds single files
+    cache_results = False
+
+    def _output(self, media_out, encoder_string, task_id, stream=False):
+        # segments can't be streamed through a single pipe, hence ``stream`` is ignored; ffmpeg
+        # writes the rendition to a local work directory instead
+        volume = get_volume(media_out.private_url)
+        manifest = os.path.basename(volume.filename(media_out.private_url))
+        try:
+            packaging = MANIFEST_FORMATS[os.path.splitext(manifest)[1].lower()]
+        except KeyError:
+            raise ValueError('%s is neither a HLS playlist nor a DASH manifest.' % manifest)
+
+        work_dir = tempfile.mkdtemp(dir=meho_settings.MEHO_TEMP_ROOT)
+        return {
+            'task_id': task_id,
+            'media': media_out,
+            'encoder_string': encoder_string,
+            'filename': os.path.join(work_dir, manifest),
+            'packaging': packaging,
+            'work_dir': work_dir
+        }
+
+    def _output_args(self, output):
+        output_args = super(SegmentedFFmpeg, self)._output_args(output)
+        duration = meho_settings.MEHO_SEGMENT_DURATION
+        stem = os.path.splitext(os.path.basename(output['filename']))[0]
+
+        output_args += ['-force_key_frames', 'expr:gte(t,n_forced*%g)' % duration]
+        if output['packaging'] == 'hls':
+            output_args += ['-f', 'hls', '-hls_time', '%g' % duration,
+                '-hls_playlist_type', 'vod',
+                '-hls_segment_filename', os.path.join(output['work_dir'], stem + '_%05d.ts'),
+                '-hls_fmp4_init_filename', stem + '_init.mp4']
+        else:
+            output_args += ['-f', 'dash', '-seg_duration', '%g' % duration,
+                '-use_template', '1', '-use_timeline', '1',
+                '-init_seg_name', stem + '_init_$RepresentationID$.$ext$',
+                '-media_seg_name', stem + '_$RepresentationID$_$Number%05d$.$ext$']
+        return output_args
+
+    def _handle_ffmpeg_complete(self, status_code, output_info):
+        try:
+            if status_code == 0:
+                for output in output_info['outputs']:
+                    try:
+                        self._save_segments(output)
+                    except Exception:
+                        logger.exception('could not save the segments of %s' % output['media'])
+                        status_code = -1
+
+            # the manifest is saved last, like any other output, so that it never refers to
+            # missing segments
+            super(SegmentedFFmpeg, self)._handle_ffmpeg_complete(status_code, output_info)
+        finally:
+            for output in output_info['outputs']:
+                shutil.rmtree(output['work_dir'], ignore_errors=True)
+
+    def _save_segments(self, output):
+        """Saves the segments ffmpeg wrote for ``output`` next to its manifest."""
+        media = output['media']
+        volume = get_volume(media.private_url)
+
+        manifest = os.path.basename(output['filename'])
+        segments = sorted(name for name in os.listdir(output['work_dir']) if name != manifest)
+        for segment in segments:
+            with open(os.path.join(output['work_dir'], segment), 'rb') as f:
+                volume.save(sibling_name(media.private_url, segment), f)
+
+        # segments are numbered, hence their list fits in a single row in practice
+        listing = '\n'.join(compress_names(segments))
+        parts = [listing[i:i + METADATA_LENGTH]
+            for i in range(0, len(listing), METADATA_LENGTH)] or ['']
+        with transaction.atomic():
+            Metadata.objects.filter(media=media, name__startswith=SEGMENT_METADATA).delete()
+            Metadata.objects.bulk_create([Metadata(media=media,
+                name=SEGMENT_METADATA if i == 0 else '%s.%i' % (SEGMENT_METADATA, i),
+                content=part) for i, part in enumerate(parts)])
+
+def segment_names(media):
+    """
+    Returns the names of the segments of ``media``, located next to its private url, or an
+    empty list if ``media`` isn't segmented.
+    """
+    rows = dict(Metadata.objects.filter(media=media, name__startswith=SEGMENT_METADATA)
+        .values_list('name', 'content'))
+    listing = ''.join(rows.get(SEGMENT_METADATA if i == 0 else '%s.%i' % (SEGMENT_METADATA, i),
+        '') for i in range(len(rows)))
+    return [sibling_name(media.private_url, segment)
+        for segment in expand_names(listing.split('\n')) if segment]
+
+def sibling_name(name, filename):
+    """Returns the name of the file ``filename`` located in the same directory as ``name``."""
+    return name.rsplit('/', 1)[0] + '/' + filename
+
+def compress_names(names):
+    """
+    Returns a compact list describing ``names``, in which consecutively numbered names are
+    replaced by ranges (e.g. ``+index_{00001-00300}.ts``) and other names are prefixed with
+    ``=``; see ``expand_names``.
+    """
+    compressed = []
+    last = None
+    for name in sorted(names):
+        stem, extension = os.path.splitext(name)
+        match = re.match(r'^(.*?)(\d+)$', stem)
+        if match is None or '{' in extension:
+            compressed.append('=' + name)
+            last = None
+            continue
+
+        prefix, number = match.groups()
+        if last is not None and (last[0], last[1]) == (prefix, extension) and \
+                len(number) == len(last[3]) and int(number) == int(last[3]) + 1:
+            last[3] = number
+            compressed[-1] = '+%s{%s-%s}%s' % (prefix, last[2], number, extension)
+        else:
+            last = [prefix, extension, number, number]
+            compressed.append('+%s{%s-%s}%s' % (prefix, number, number, extension))
+    return compressed
+
+def expand_names(compressed):
+    """Returns the list of names described by ``compressed``, as returned by ``compress_names``."""
+    names = []
+    for item in compressed:
+        if item.startswith('='):
+            names.append(item[1:])
+            continue
+
+        match = re.match(r'^\+(.*)\{(\d+)-(\d+)\}([^{]*)$', item)
+        if match is None:
+            continue
+        prefix, start, end, extension = match.groups()
+        names += ['%s%0*i%s' % (prefix, len(start), number, extension)
+            for number in range(int(start), int(end) + 1)]
+    return names
@@ -0,0 +1,227 @@
+# This source file is part of django-meho
+# Main Developer : Dimitri Racordon (kyouko.taiga@gmail.com)
+#
+# Copyright 2013 Dimitri Racordon
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio, logging, os, signal, threading
+
+from asyncio.subprocess import DEVNULL
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger('meho')
+
+class FFmpegSupervisor(object):
+    """
+    Supervises every running ffmpeg process of the current process from a single asyncio event
+    loop, running in a dedicated thread.
+
+    The progress streams of all processes are multiplexed on the loop, so that the number of
+    threads doesn't depend on the number of running processes. Callers submit processes from
+    any thread and either wait for their completion or get a future. Progress handlers are run
+    by a separate thread, so that a slow handler (e.g. waiting for the cache) doesn't hold up
+    the supervision of the other processes.
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._lock = threading.Lock()
+        # maps running processes to the key they were submitted with, several processes may
+        # share the same key
+        self._processes = {}
+        # process groups of the running processes, killed if the worker shuts down (see
+        # ``kill_all``); unlike ``_processes``, they're also read outside of the loop
+        self._groups = set()
+        self._groups_lock = threading.Lock()
+        self._killed_all = False
+        # a single thread, so that the samples of a process are handled in order
+        self._handlers = ThreadPoolExecutor(1)
+
+    def start(self):
+        with self._lock:
+            if self._loop is not None:
+                return
+            self._loop = asyncio.new_event_loop()
+            t = threading.Thread(target=self._loop.run_forever, name='meho-ffmpeg-supervisor')
+            t.setDaemon(True)
+            t.start()
+
+    def submit(self, task_id, args, on_progress=None, stdin=None, stdout=None, stderr=None,
+            timeout=None, limits=None):
+        """
+        Spawns the ffmpeg command described by ``args`` and returns a
+        ``concurrent.futures.Future`` whose result is the exit status of the process.
+
+        The supervisor asks ffmpeg to write its progress stream on a dedicated pipe, so that
+        ``stdin`` and ``stdout`` can carry media data. ``on_progress`` is called with every
+        sample parsed from that stream, in order, from the supervisor's handler thread shared by
+        all processes; it should return quickly.
+        ``stdin`` and ``stdout`` may be file descriptors, which are closed in the calling process
+        once the child is spawned. If the process is still running after ``timeout`` seconds,
+        it's killed.
+
+        ``limits`` is a dictionary of resource limits applied to the process: ``nice`` (the
+        niceness increment), ``cpu_affinity`` (a list of CPU indices) and ``memory`` (the maximum
+        size of its address space, in bytes).
+        """
+        self.start()
+        return asyncio.run_coroutine_threadsafe(self._supervise(
+            task_id, args, on_progress, stdin, stdout, stderr, timeout, limits), self._loop)
+
+    def run(self, task_id, args, on_progress=None, stdin=None, stdout=None, stderr=None,
+            timeout=None, limits=None):
+        """Same as ``submit`` but blocks the caller until the process exits."""
+        return self.submit(
+            task_id, args, on_progress, stdin, stdout, stderr, timeout, limits).result()
+
+    def cancel(self, task_id):
+        """
+        Kills the processes of task ``task_id``; returns ``False`` if none is supervised here.
+        """
+        if task_id not in list(self._processes.values()):
+            return False
+        self._loop.call_soon_threadsafe(self._kill, task_id)
+        return True
+
+    def kill_all(self):
+        """
+        Kills the processes of every task, along with the processes they spawned, from the
+        calling thread; returns the number of processes killed. Called when the worker shuts
+        down, since processes run in their own session and would otherwise outlive it.
+        """
+        with self._groups_lock:
+            # processes spawned from now on are killed right away
+            self._killed_all = True
+            groups = list(self._groups)
+        for pgid in groups:
+            try:
+                os.killpg(pgid, signal.SIGKILL)
+            except (OSError, ProcessLookupError):
+                pass
+        return len(groups)
+
+    def _kill(self, task_id):
+        for process, key in list(self._processes.items()):
+            if key == task_id and process.returncode is None:
+                kill_process_group(process)
+
+    async def _supervise(self, task_id, args, on_progress, stdin, stdout, stderr, timeout,
+            limits):
+        # avoid circular import
+        from meho.core.encoders.ffmpeg import FFmpegProgressParser
+
+        progress_in, progress_out = os.pipe()
+        args = [args[0], '-progress', 'pipe:%i' % progress_out] + list(args[1:])
+        if limits:
+            args = limit_command(limits) + args
+        try:
+            process = await asyncio.create_subprocess_exec(*args,
+                stdin=DEVNULL if stdin is None else stdin,
+                stdout=DEVNULL if stdout is None else stdout,
+                stderr=stderr, close_fds=True, pass_fds=(progress_out,), start_new_session=True)
+        except:
+            os.close(progress_in)
+            raise
+        finally:
+            # the child has its own copies of these descriptors; closing ours lets the readers
+            # and writers on the other ends see EOF when the child exits
+            os.close(progress_out)
+            for fd in (stdin, stdout):
+                if isinstance(fd, int):
+                    os.close(fd)
+
+        self._processes[process] = task_id
+        with self._groups_lock:
+            self._groups.add(process.pid)
+            killed = self._killed_all
+        if killed:
+            kill_process_group(process)
+        logger.info('started ffmpeg job [%i] for task [%s]' % (process.pid, task_id))
+
+        progress = asyncio.StreamReader()
+        transport, _ = await self._loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(progress), os.fdopen(progress_in, 'rb', 0))
+
+        def handle_progress(sample):
+            try:
+                on_progress(sample)
+            except Exception:
+                logger.exception('progress handler of task [%s] failed' % task_id)
+
+        async def read_progress():
+            parser = FFmpegProgressParser()
+            while True:
+                chunk = await progress.read(4096)
+                if not chunk:
+                    break
+                for sample in parser.feed(chunk):
+                    if on_progress is not None:
+                        self._handlers.submit(handle_progress, sample)
+            if on_progress is not None:
+                # let the handler catch up, so that no sample is handled once the future is done
+                await asyncio.wrap_future(self._handlers.submit(lambda: None))
+            return await process.wait()
+
+        try:
+            return await asyncio.wait_for(read_progress(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning('ffmpeg job [%i] for task [%s] timed out' % (process.pid, task_id))
+            kill_process_group(process)
+            return await process.wait()
+        except asyncio.CancelledError:
+            if process.returncode is None:
+                kill_process_group(process)
+                await process.wait()
+            raise
+        finally:
+            transport.close()
+            self._processes.pop(process, None)
+            with self._groups_lock:
+                self._groups.discard(process.pid)
+
+def kill_process_group(process):
+    """Kills ``process`` along with any process it spawned."""
+    try:
+        # processes are spawned in their own session, hence lead their own process group
+        os.killpg(process.pid, signal.SIGKILL)
+    except (OSError, ProcessLookupError):
+        process.kill()
+
+def limit_command(limits):
+    """
+    Returns the command prefix applying the resource ``limits`` (see ``FFmpegSupervisor.submit``)
+    to the command it precedes, with the ``nice``, ``taskset`` and ``prlimit`` utilities.
+
+    Limits are applied by these utilities before ffmpeg is executed, rather than by a function
+    run in the child between fork and exec, which isn't safe in a multithreaded process.
+    """
+    prefix = []
+    if limits.get('nice'):
+        prefix += ['nice', '-n', str(limits['nice'])]
+    if limits.get('cpu_affinity'):
+        prefix += ['taskset', '-c', ','.join(str(cpu) for cpu in limits['cpu_affinity'])]
+    if limits.get('memory'):
+        prefix += ['prlimit', '--as=%i' % limits['memory'], '--']
+    return prefix
+
+_supervisor = None
+_supervisor_lock = threading.Lock()
+
+def get_supervisor():
+    """Returns the process-wide ffmpeg supervisor, creating it on first use."""
+    global _supervisor
+    with _supervisor_lock:
+        if _supervisor is None:
+            _supervisor = FFmpegSupervisor()
+        return _supervisor
@@ -0,0 +1,141 @@
+# This source file is part of django-meho
+# Main Developer : Dimitri Racordon (kyouko.taiga@gmail.com)
+#
+# Copyright 2013 Dimitri Racordon
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io, logging, math, os
+import meho.settings as meho_settings
+
+from django.db import transaction
+from meho.core.encoders.ffmpeg import FFmpeg
+from meho.core.volumes import get_volume
+from meho.models import Media, Metadata
+
+logger = logging.getLogger('meho')
+
+# prefix of the names of the metadata rows describing the grid of a sprite sheet
+SPRITE_PREFIX = 'sprite.'
+
+class Thumbnails(FFmpeg):
+    """
+    A ffmpeg encoder extracting ``MEHO_THUMBNAIL_FRAMES`` evenly spaced frames of its input and
+    tiling them into a sprite sheet, saved to the private url of the output media (e.g. a
+    ``.jpg`` file), for scrubbing previews.
+
+    Frames are extracted by a single ffmpeg process that only decodes keyframes, each frame
+    being the keyframe closest to its position. The encoder string gives additional ffmpeg
+    output arguments (e.g. ``-q:v 4``).
+
+    A WebVTT index mapping time ranges to regions of the sprite sheet is saved next to it, as
+    a media whose parent is the input media; the grid is described by ``sprite.*`` metadata of
+    the sprite sheet media, ``sprite.index`` being the urn of the index media.
+    """
+
+    # the index and metadata of a sprite sheet can't be restored from the result cache
+    cache_results = False
+
+    def _output(self, media_out, encoder_string, task_id, stream=False):
+        # the sprite sheet is a single image written at the end of the input, hence there's
+        # nothing to gain from streaming it
+        return super(Thumbnails, self)._output(media_out, encoder_string, task_id)
+
+    def _start_ffmpeg_task(self, input_file, input_info, output_info):
+        # compute the grid from the dimensions and duration of the input
+        frames = meho_settings.MEHO_THUMBNAIL_FRAMES
+        columns = min(meho_settings.MEHO_THUMBNAIL_COLUMNS, frames)
+        width = meho_settings.MEHO_THUMBNAIL_WIDTH
+        try:
+            height = int(round(width * input_info['height'] / input_info['width'] / 2.0)) * 2
+        except (TypeError, ZeroDivisionError):
+            raise ValueError('The input has no video stream.')
+
+        grid = {
+            'frames': frames,
+            'columns': columns,
+            'rows': int(math.ceil(frames / float(columns))),
+            'width': width,
+            'height': height,
+            'interval': (input_info['duration'] or 0.0) / frames or 1.0
+        }
+        for output in output_info['outputs']:
+            output['grid'] = grid
+        super(Thumbnails, self)._start_ffmpeg_task(input_file, input_info, output_info)
+
+    def _input_args(self, input_info):
+        # only decode keyframes, which is much faster than decoding every frame of the input
+        return ['-skip_frame', 'nokey']
+
+    def _output_args(self, output):
+        grid = output['grid']
+        video_filter = 'fps=1/%f,scale=%i:%i,tile=%ix%i' % (grid['interval'], grid['width'],
+            grid['height'], grid['columns'], grid['rows'])
+        return ['-an', '-fps_mode', 'vfr', '-vf', video_filter, '-frames:v', '1'] + \
+            super(Thumbnails, self)._output_args(output)
+
+    def _handle_ffmpeg_complete(self, status_code, output_info):
+        super(Thumbnails, self)._handle_ffmpeg_complete(status_code, output_info)
+
+        for output in output_info['outputs']:
+            if output['media'].status == 'ready':
+                try:
+                    self._save_index(output['media'], output['grid'])
+                except Exception:
+                    logger.exception('could not save the index of %s' % output['media'])
+
+    def _save_index(self, media, grid):
+        """Saves the WebVTT index of the sprite sheet ``media`` and records its grid."""
+        volume = get_volume(media.private_url)
+        index_url = os.path.splitext(media.private_url)[0] + '.vtt'
+        sprite_name = os.path.basename(volume.filename(media.private_url))
+
+        content = webvtt_index(sprite_name, grid).encode('utf-8')
+        volume.save(index_url, io.BytesIO(content))
+
+        with transaction.atomic():
+            # transcoding the sprite sheet again updates its index rather than adding another
+            index = Media.objects.filter(private_url=index_url).order_by('urn').first()
+            if index is None:
+                index = Media(private_url=index_url, media_type='text/vtt')
+            index.parent = media.parent
+            index.save()
+
+            rows = [Metadata(media=media, name=SPRITE_PREFIX + 'index', content=index.urn)]
+            for field in ('frames', 'columns', 'rows', 'width', 'height', 'interval'):
+                rows.append(Metadata(media=media, name=SPRITE_PREFIX + field,
+                    content=str(grid[field])))
+            Metadata.objects.filter(media=media, name__startswith=SPRITE_PREFIX).delete()
+            Metadata.objects.bulk_create(rows)
+
+def webvtt_index(sprite_name, grid):
+    """
+    Returns a WebVTT document mapping the time range of each frame of a sprite sheet to its
+    region, using media fragments of ``sprite_name``, relative to the document.
+    """
+    lines = ['WEBVTT', '']
+    for frame in range(grid['frames']):
+        x = (frame % grid['columns']) * grid['width']
+        y = (frame // grid['columns']) * grid['height']
+        lines.append('%s --> %s' % (webvtt_timestamp(frame * grid['interval']),
+            webvtt_timestamp((frame + 1) * grid['interval'])))
+        lines.append('%s#xywh=%i,%i,%i,%i' % (sprite_name, x, y, grid['width'], grid['height']))
+        lines.append('')
+    return '\n'.join(lines)
+
+def webvtt_timestamp(seconds):
+    """Formats ``seconds`` as a WebVTT timestamp (``hh:mm:ss.ttt``)."""
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    return '%02i:%02i:%06.3f' % (hours, minutes, milliseconds / 1000.0)
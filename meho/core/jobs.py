@@ -0,0 +1,388 @@
+# This source file is part of django-meho
+# Main Developer : Dimitri Racordon (kyouko.taiga@gmail.com)
+#
+# Copyright 2013 Dimitri Racordon
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging, os, shutil, socket
+import threading, time, uuid
+import meho.settings as meho_settings
+
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+from meho.core.encoders import load_encoder
+from meho.core.encoders.chunked import read_state
+from meho.core.progress import report_progress
+from meho.core.results import fetch_result, store_result
+from meho.models import Job, Media
+
+logger = logging.getLogger('meho')
+
+# serializes the claims of the threads of this process
+_claim_lock = threading.Lock()
+
+class QueueFull(Exception):
+    pass
+
+def enqueue_job(media_in, media_out, encoder, encoder_string='', priority=0, owner=None):
+    """
+    Records a new transcoding job in the job table and returns it. The job will be run by the
+    first available worker, either the in-process worker pool or a ``meho_worker`` command.
+
+    Jobs with a higher ``priority`` are run first; ``owner`` is the user who requested the job,
+    used to share workers fairly between users.
+
+    Raises ``QueueFull`` if ``MEHO_WORKER_QUEUE_SIZE`` jobs are already waiting.
+    """
+    return enqueue_jobs(media_in, [(media_out, encoder_string)], encoder, priority, owner)[0]
+
+def enqueue_jobs(media_in, outputs, encoder, priority=0, owner=None):
+    """
+    Records a group of transcoding jobs sharing the same input and encoder and returns them.
+    ``outputs`` is a list of ``(media_out, encoder_string)`` pairs.
+
+    Jobs of a group are claimed together by a single worker, so that encoders supporting it can
+    produce all outputs while decoding the input only once.
+
+    Raises ``QueueFull`` if ``MEHO_WORKER_QUEUE_SIZE`` jobs are already waiting.
+    """
+    if meho_settings.MEHO_WORKER_QUEUE_SIZE:
+        pending = Job.objects.filter(status='queued').count()
+        if pending >= meho_settings.MEHO_WORKER_QUEUE_SIZE:
+            raise QueueFull('The job queue is full (%i pending jobs).' % pending)
+
+    # outputs found in the result cache are copied from it by the worker running the job (see
+    # ``run_jobs``) rather than here, since copying them may take as long as any upload
+    group = uuid.uuid4().hex if len(outputs) > 1 else ''
+    jobs = []
+    with transaction.atomic():
+        for media_out, encoder_string in outputs:
+            job = Job(media_in=media_in, media_out=media_out, encoder=encoder,
+                encoder_string=encoder_string, group=group, priority=priority, owner=owner)
+            job.save()
+            jobs.append(job)
+
+    for job in jobs:
+        report_progress(job.task_id, {
+            'status': 'queued',
+            'queued_at': time.time(),
+            'eta': 0,
+            'progress': 0
+        })
+        logger.info('queued job [%s]' % job.task_id)
+
+    if meho_settings.MEHO_JOBS_IN_PROCESS:
+        # avoid circular import
+        from meho.core.workers import get_worker_pool
+        get_worker_pool().notify()
+
+    return jobs
+
+def claim_jobs(worker):
+    """
+    Marks the next job to run, along with the other jobs of its group, as running on ``worker``
+    and returns them, or returns an empty list if there isn't any job waiting. Concurrent
+    workers never claim the same job.
+
+    Jobs with a higher priority are served first. Among jobs of the same priority, the owner
+    with the fewest running jobs is served first, and owners already running
+    ``MEHO_JOB_USER_CONCURRENCY`` jobs are skipped; only the jobs of a group that fit within
+    that cap are claimed.
+    """
+    queued = Job.objects.filter(status='queued').order_by('-priority', 'created', 'pk')
+    window = meho_settings.MEHO_SCHEDULER_WINDOW
+
+    # claim a job with a conditional update, so that only one of several concurrent workers can
+    # switch it to running; claims of the threads of this process are also serialized, so that
+    # they don't compete for the same jobs
+    with _claim_lock:
+        candidates = list(queued.values_list('pk', 'group', 'owner', 'priority')[:window])
+        running = running_jobs_per_owner()
+        for pk, group, owner, priority in schedule(candidates, running):
+            claimed = Job.objects.filter(pk=pk, status='queued').update(
+                status='running', worker=worker, started=timezone.now())
+            if claimed:
+                if group:
+                    # the rest of the group counts towards the concurrency cap of its owner too;
+                    # jobs beyond it are left queued and claimed later
+                    rest = Job.objects.filter(group=group, status='queued')
+                    cap = meho_settings.MEHO_JOB_USER_CONCURRENCY
+                    if cap and owner is not None:
+                        allowed = max(cap - running.get(owner, 0) - 1, 0)
+                        rest = Job.objects.filter(pk__in=list(
+                            rest.order_by('pk').values_list('pk', flat=True)[:allowed]),
+                            status='queued')
+                    rest.update(status='running', worker=worker, started=timezone.now())
+                    return list(Job.objects.filter(group=group, worker=worker,
+                        status='running').order_by('pk'))
+                return [Job.objects.get(pk=pk)]
+    return []
+
+def running_jobs_per_owner():
+    """Returns a dictionary mapping owner identifiers to their number of running jobs."""
+    running = Job.objects.filter(status='running').values('owner').annotate(count=Count('pk'))
+    return {row['owner']: row['count'] for row in running}
+
+def schedule(candidates, running):
+    """
+    Sorts ``candidates``, a list of ``(pk, group, owner, priority)`` tuples of queued jobs in
+    the order they were queued, in the order they should be tried, skipping the jobs of owners
+    that reached their concurrency cap. ``running`` maps owners to their number of running jobs.
+    """
+    cap = meho_settings.MEHO_JOB_USER_CONCURRENCY
+    eligible = [(index, candidate) for index, candidate in enumerate(candidates)
+        if not cap or candidate[2] is None or running.get(candidate[2], 0) < cap]
+    eligible.sort(key=lambda item: (-item[1][3], running.get(item[1][2], 0), item[0]))
+    return [candidate for index, candidate in eligible]
+
+def run_jobs(jobs):
+    """
+    Runs ``jobs``, as returned by ``claim_jobs``, in the calling thread; returns once their
+    encoder is done.
+    """
+    wait_times = {}
+    for job in jobs:
+        wait_times[job.task_id] = (job.started - job.created).total_seconds()
+        report_progress(job.task_id, {
+            'status': 'running',
+            'wait_time': wait_times[job.task_id],
+            'eta': 0,
+            'progress': 0
+        })
+
+    # all jobs of a group share the same input and encoder
+    media_in = jobs[0].media_in
+    encoder_name = jobs[0].encoder
+    outputs = []
+    for job in jobs:
+        try:
+            if fetch_result(media_in, job.media_out, encoder_name, job.encoder_string):
+                continue
+        except Exception:
+            logger.exception('could not look %s up in the result cache' % job.media_out)
+        outputs.append((job.media_out, job.encoder_string, job.task_id))
+
+    try:
+        encoder_class = load_encoder(meho_settings.MEHO_ENCODERS[encoder_name])
+        limits = meho_settings.MEHO_ENCODER_LIMITS.get(encoder_name)
+        encoder = encoder_class(limits=limits) if limits else encoder_class()
+        if outputs and hasattr(encoder, 'transcode_many'):
+            encoder.transcode_many(media_in, outputs)
+        else:
+            for media_out, encoder_string, task_id in outputs:
+                encoder.transcode(media_in, media_out, encoder_string, task_id=task_id)
+    except Exception:
+        logger.exception('job [%s] failed' % ', '.join(job.task_id for job in jobs))
+        for media_out, encoder_string, task_id in outputs:
+            if media_out.status != 'ready':
+                media_out.status = 'failed'
+                media_out.save()
+
+    for media_out, encoder_string, task_id in outputs:
+        if media_out.status == 'ready':
+            try:
+                store_result(media_in, media_out, encoder_name, encoder_string)
+            except Exception:
+                logger.exception('could not store %s in the result cache' % media_out)
+
+    for job in jobs:
+        # the job may have been recovered by another worker in between, e.g. if this one lost
+        # its database connection for longer than ``MEHO_JOB_RECOVERY_TIMEOUT``, in which case
+        # its state belongs to the other worker
+        job.finished = timezone.now()
+        if Job.objects.filter(pk=job.pk, worker=job.worker, status='cancelling').update(
+                status='cancelled', finished=job.finished):
+            job.status = 'cancelled'
+        else:
+            status = 'done' if job.media_out.status == 'ready' else 'failed'
+            if not Job.objects.filter(pk=job.pk, worker=job.worker, status='running').update(
+                    status=status, finished=job.finished):
+                logger.warning('job [%s] was taken over by another worker' % job.task_id)
+                continue
+            job.status = status
+
+        report_progress(job.task_id, {
+            'status': job.status,
+            'wait_time': wait_times[job.task_id],
+            'eta': 0,
+            'progress': 100
+        })
+        logger.info('job [%s] finished with status %s' % (job.task_id, job.status))
+
+def cancel_job(job):
+    """
+    Cancels ``job``, along with the other jobs of its group since they share the same process;
+    returns ``False`` if the job has already finished.
+
+    Queued jobs are cancelled right away. Running jobs are flagged so that the worker running
+    them kills their process and marks their output as failed.
+    """
+    jobs = Job.objects.filter(group=job.group) if job.group else Job.objects.filter(pk=job.pk)
+
+    queued = list(jobs.filter(status='queued'))
+    if jobs.filter(status='queued').update(status='cancelled', finished=timezone.now()):
+        for queued_job in queued:
+            queued_job.media_out.status = 'failed'
+            queued_job.media_out.save()
+            report_progress(queued_job.task_id, {'status': 'cancelled', 'eta': 0, 'progress': 0})
+            logger.info('job [%s] cancelled' % queued_job.task_id)
+        return True
+
+    if jobs.filter(status='running').update(status='cancelling'):
+        logger.info('job [%s] is being cancelled' % job.task_id)
+        return True
+    return False
+
+def is_cancelled(task_ids):
+    """Returns whether one of the jobs identified by ``task_ids`` is being cancelled."""
+    return Job.objects.filter(task_id__in=task_ids, status='cancelling').exists()
+
+def record_job_state(task_ids, **state):
+    """
+    Records the state of the running jobs identified by ``task_ids`` (e.g. ``work_path``), so
+    that they can be recovered if their worker dies.
+    """
+    Job.objects.filter(task_id__in=task_ids).update(**state)
+
+def heartbeat_jobs(pool_name):
+    """
+    Records that the running jobs of the workers of the pool ``pool_name`` are still alive, so
+    that the recovery pass doesn't take them for orphaned jobs, however long they run.
+    """
+    return Job.objects.filter(worker__startswith=pool_name + '/',
+        status__in=('running', 'cancelling')).update(progressed_at=timezone.now())
+
+def recover_jobs():
+    """
+    Queues again the running jobs whose worker died, so that they're resumed by another worker
+    instead of leaving their output in the ``transcoding`` status forever; returns the list of
+    recovered jobs.
+
+    A job is orphaned if its worker was a process of this host that no longer exists, or if its
+    worker pool didn't record any heartbeat for ``MEHO_JOB_RECOVERY_TIMEOUT`` seconds (see
+    ``heartbeat_jobs``). Encoders able to do so
+    resume recovered jobs from their work path (see ``ChunkedFFmpeg``); others start over.
+    """
+    cutoff = timezone.now() - timedelta(seconds=meho_settings.MEHO_JOB_RECOVERY_TIMEOUT)
+    stale = Q(progressed_at__lt=cutoff) | Q(progressed_at__isnull=True, started__lt=cutoff)
+
+    recovered = []
+    for job in Job.objects.filter(status__in=('running', 'cancelling')):
+        if not (_worker_died(job.worker) or Job.objects.filter(stale, pk=job.pk).exists()):
+            continue
+
+        if job.status == 'cancelling':
+            # the job was being cancelled anyway
+            if Job.objects.filter(pk=job.pk, status='cancelling').update(
+                    status='cancelled', finished=timezone.now()):
+                _remove_work_path(job.work_path)
+                job.media_out.status = 'failed'
+                job.media_out.save()
+                report_progress(job.task_id, {'status': 'cancelled', 'eta': 0, 'progress': 0})
+            continue
+
+        # a worker might still pick the job up in between, hence the conditional update
+        if Job.objects.filter(pk=job.pk, status='running', worker=job.worker).update(
+                status='queued', worker='', started=None, progressed_at=None):
+            discard_work_path(job)
+            report_progress(job.task_id, {'status': 'queued', 'eta': 0, 'progress': 0})
+            logger.warning('job [%s] of worker [%s] was orphaned, queued it again' % (
+                job.task_id, job.worker))
+            recovered.append(job)
+
+    # media whose jobs all finished without updating them (e.g. because their worker died
+    # before jobs were recorded durably) can't be recovered anymore
+    orphaned = Media.objects.filter(status='transcoding', jobs__isnull=False).exclude(
+        jobs__status__in=('queued', 'running', 'cancelling')).distinct()
+    for media in orphaned:
+        logger.warning('media %s was orphaned while transcoding' % media)
+        media.status = 'failed'
+        media.save()
+    return recovered
+
+def release_jobs(pool_name):
+    """
+    Queues again the running jobs of the workers of the pool ``pool_name``, and cancels the jobs
+    being cancelled, so that a stopping pool leaves its jobs to other workers right away; returns
+    the released jobs. Their work paths are left as is, since their processes may still be
+    running (see ``discard_work_path``).
+    """
+    released = []
+    # claims in progress are done first, since their jobs would be left behind otherwise
+    with _claim_lock:
+        running = Job.objects.filter(worker__startswith=pool_name + '/',
+            status__in=('running', 'cancelling')).order_by('pk')
+        for job in running:
+            if job.status == 'cancelling':
+                if Job.objects.filter(pk=job.pk, status='cancelling').update(
+                        status='cancelled', finished=timezone.now()):
+                    job.media_out.status = 'failed'
+                    job.media_out.save()
+                    report_progress(job.task_id, {'status': 'cancelled', 'eta': 0, 'progress': 0})
+                    released.append(job)
+            elif Job.objects.filter(pk=job.pk, status='running', worker=job.worker).update(
+                    status='queued', worker='', started=None, progressed_at=None):
+                report_progress(job.task_id, {'status': 'queued', 'eta': 0, 'progress': 0})
+                logger.info('job [%s] of worker [%s] was released' % (job.task_id, job.worker))
+                released.append(job)
+    return released
+
+def discard_work_path(job):
+    """
+    Removes the work path of ``job``, released by its worker, unless the job was queued again
+    and its encoder can resume from it.
+    """
+    if job.work_path and (job.status == 'cancelling' or read_state(job.work_path) is None):
+        # only the work directories of chunked tasks can be resumed; partial outputs of a single
+        # process, or segmented renditions, are started over
+        _remove_work_path(job.work_path)
+        Job.objects.filter(pk=job.pk, work_path=job.work_path).update(work_path='')
+
+def _worker_died(worker):
+    """Returns whether ``worker`` was a process of this host that no longer exists."""
+    # worker names are formatted as ``<hostname>:<pid>/<thread>`` (see ``WorkerPool``)
+    process = worker.partition('/')[0]
+    host, _, pid = process.rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    if int(pid) == os.getpid():
+        # jobs of this process can only be orphaned if it was restarted under the same pid
+        return not any(t.name == worker.partition('/')[2] for t in threading.enumerate())
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+def _remove_work_path(work_path):
+    if not work_path:
+        return
+    if os.path.isdir(work_path):
+        shutil.rmtree(work_path, ignore_errors=True)
+    elif os.path.exists(work_path):
+        os.remove(work_path)
+
+def queue_stats():
+    """Returns a dictionary describing the load of the job queue."""
+    queued = Job.objects.filter(status='queued')
+    oldest = queued.order_by('created').values_list('created', flat=True).first()
+    return {
+        'queued': queued.count(),
+        'running': Job.objects.filter(status='running').count(),
+        'max_wait_time': (timezone.now() - oldest).total_seconds() if oldest else 0
+    }
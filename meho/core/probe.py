@@ -0,0 +1,127 @@
+# This source file is part of django-meho
+# Main Developer : Dimitri Racordon (kyouko.taiga@gmail.com)
+#
+# Copyright 2013 Dimitri Racordon
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging, os, tempfile
+
+from django.db import transaction
+from meho.core.encoders.ffmpeg import ProbeError, parse_ffprobe
+from meho.core.volumes import get_volume
+from meho.core.volumes.filesystem import copy_fileobj
+from meho.models import Metadata
+
+logger = logging.getLogger('meho')
+
+# prefix of the names of the metadata rows holding probe results
+PROBE_PREFIX = 'probe.'
+
+# converters of the probed properties, which are stored as strings
+PROBE_FIELDS = {
+    'duration': float,
+    'format': str,
+    'video_codec': str,
+    'audio_codec': str,
+    'width': int,
+    'height': int
+}
+
+def summarize_ffprobe(info):
+    """Extracts the properties listed in ``PROBE_FIELDS`` from the output of ``parse_ffprobe``."""
+    summary = dict.fromkeys(PROBE_FIELDS)
+    summary['duration'] = float(info.get('format', {}).get('duration', 0) or 0)
+    summary['format'] = info.get('format', {}).get('format_name')
+
+    for stream in info.get('streams', []):
+        if stream.get('codec_type') == 'video' and summary['video_codec'] is None:
+            summary['video_codec'] = stream.get('codec_name')
+            summary['width'] = stream.get('width')
+            summary['height'] = stream.get('height')
+        elif stream.get('codec_type') == 'audio' and summary['audio_codec'] is None:
+            summary['audio_codec'] = stream.get('codec_name')
+    return summary
+
+def probe_media(media, input_file=None, volume=None, cached_only=False):
+    """
+    Returns the properties listed in ``PROBE_FIELDS`` for ``media``.
+
+    Results are persisted as metadata of the media, along with the identity of the probed file
+    as reported by its volume, so that ``ffprobe`` only runs again if the file has changed.
+    ``input_file`` is the location passed to ``ffprobe`` on a cache miss; it's derived from the
+    private url of the media if not provided. If ``cached_only`` is set, returns ``None`` on a
+    cache miss instead of running ``ffprobe``. Raises ``ProbeError`` if ``ffprobe`` fails.
+    """
+    if volume is None:
+        volume = get_volume(media.private_url)
+
+    try:
+        identity = volume.identity(media.private_url)
+    except NotImplementedError:
+        identity = None
+
+    if identity is not None:
+        stored = dict(Metadata.objects.filter(media=media, name__startswith=PROBE_PREFIX)
+            .values_list('name', 'content'))
+        if stored.get(PROBE_PREFIX + 'identity') == identity:
+            summary = {}
+            for field, converter in PROBE_FIELDS.items():
+                value = stored.get(PROBE_PREFIX + field, '')
+                summary[field] = converter(value) if value else None
+            return summary
+
+    if cached_only:
+        return None
+
+    # probe the file
+    temporary = False
+    if input_file is None:
+        input_file, temporary = _probe_location(media, volume)
+    try:
+        summary = summarize_ffprobe(parse_ffprobe(input_file))
+    finally:
+        if temporary:
+            os.remove(input_file)
+
+    if identity is not None:
+        with transaction.atomic():
+            Metadata.objects.filter(media=media, name__startswith=PROBE_PREFIX).delete()
+            rows = [Metadata(media=media, name=PROBE_PREFIX + 'identity', content=identity)]
+            for field in PROBE_FIELDS:
+                if summary[field] is not None:
+                    rows.append(Metadata(media=media, name=PROBE_PREFIX + field,
+                        content=str(summary[field])))
+            Metadata.objects.bulk_create(rows)
+
+    return summary
+
+def _probe_location(media, volume):
+    """
+    Returns a location ``ffprobe`` can read the file of ``media`` from, and whether it's a
+    temporary copy that should be removed after use.
+    """
+    try:
+        return volume.path(media.private_url), False
+    except NotImplementedError:
+        pass
+    try:
+        return 'cache:' + volume.url(media.private_url), False
+    except NotImplementedError:
+        pass
+
+    # copy the file to a local temporary file
+    fd, tmp_name = tempfile.mkstemp()
+    with open(fd, 'wb') as tmp_file, volume.open(media.private_url) as f:
+        copy_fileobj(f, tmp_file)
+    return tmp_name, True
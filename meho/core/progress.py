@@ -0,0 +1,138 @@
+# This source file is part of django-meho
+# Main Developer : Dimitri Racordon (kyouko.taiga@gmail.com)
+#
+# Copyright 2013 Dimitri Racordon
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging, threading, time
+import meho.settings as meho_settings
+
+from django.core.cache import cache
+
+logger = logging.getLogger('meho')
+
+TERMINAL_STATES = ('ready', 'done', 'failed', 'cancelled')
+
+class ProgressReporter(object):
+    """
+    Coalesces the status updates of all the tasks of the current process and writes them to the
+    cache in batches.
+
+    Updates are buffered and flushed with a single ``cache.set_many`` call at most once every
+    ``interval`` seconds by a background thread, so that reporting progress never waits for the
+    cache; updates whose progress differs from the last written one by less than ``min_delta``
+    percent are dropped. Changes of state are flushed right away, terminal states synchronously;
+    terminal states are kept in the cache for ``retention`` seconds, while other states expire
+    after ``timeout`` seconds unless they're refreshed.
+    """
+
+    def __init__(self, interval=None, min_delta=None, timeout=None, retention=None):
+        self.interval = interval if interval is not None else meho_settings.MEHO_PROGRESS_INTERVAL
+        self.min_delta = min_delta if min_delta is not None \
+            else meho_settings.MEHO_PROGRESS_MIN_DELTA
+        self.timeout = timeout if timeout is not None else meho_settings.MEHO_TASK_TIMEOUT
+        self.retention = retention if retention is not None \
+            else meho_settings.MEHO_TASK_RETENTION
+
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._written = {}
+        self._written_at = {}
+        self._wakeup = threading.Event()
+        self._flusher = None
+
+    def update(self, task_id, status):
+        """Reports the new ``status`` of task ``task_id``."""
+        status = dict(status)
+        terminal = status.get('status') in TERMINAL_STATES
+
+        with self._lock:
+            last = self._pending.get(task_id) or self._written.get(task_id)
+            changed = last is None or last.get('status') != status.get('status')
+            if not changed:
+                if abs(status.get('progress', 0) - last.get('progress', 0)) < self.min_delta:
+                    return
+
+            self._pending[task_id] = status
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_periodically,
+                    name='meho-progress')
+                self._flusher.setDaemon(True)
+                self._flusher.start()
+
+        if terminal:
+            # the process may exit right after its last task finished
+            self.flush()
+        elif changed:
+            self._wakeup.set()
+
+    def get(self, task_id):
+        """Returns the last status reported for task ``task_id``."""
+        with self._lock:
+            status = self._pending.get(task_id) or self._written.get(task_id)
+        if status is None:
+            status = cache.get(task_id)
+        return dict(status) if status is not None else None
+
+    def flush(self):
+        """Writes all pending updates to the cache."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            now = time.time()
+
+            running, terminal = {}, {}
+            for task_id, status in pending.items():
+                if status.get('status') in TERMINAL_STATES:
+                    terminal[task_id] = status
+                    self._written.pop(task_id, None)
+                    self._written_at.pop(task_id, None)
+                else:
+                    running[task_id] = status
+                    self._written[task_id] = status
+                    self._written_at[task_id] = now
+
+            # forget the tasks whose status expired from the cache, e.g. because their worker
+            # died before they reached a terminal state
+            for task_id, written_at in list(self._written_at.items()):
+                if now - written_at > self.timeout:
+                    del self._written[task_id], self._written_at[task_id]
+
+        if running:
+            cache.set_many(running, timeout=self.timeout)
+        if terminal:
+            cache.set_many(terminal, timeout=self.retention)
+
+    def _flush_periodically(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('could not write task progress to the cache')
+
+_reporter = None
+_reporter_lock = threading.Lock()
+
+def get_reporter():
+    """Returns the process-wide progress reporter, creating it on first use."""
+    global _reporter
+    with _reporter_lock:
+        if _reporter is None:
+            _reporter = ProgressReporter()
+        return _reporter
+
+def report_progress(task_id, status):
+    """Reports the new ``status`` of task ``task_id`` with the process-wide reporter."""
+    get_reporter().update(task_id, status)
@@ -15,14 +15,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import errno, os, shutil
+import errno, os, tempfile
 import meho.settings as meho_settings
 
 from django.conf import settings
 from django.utils.module_loading import import_by_path
 from django.utils.six.moves.urllib.parse import urljoin
 from django.utils._os import safe_join, abspathu
-from meho.core.volumes import VolumeSelector
+from meho.core.encoders.segmented import segment_names
+from meho.core.volumes import get_volume
+from meho.core.volumes.filesystem import copy_fileobj
 
 class SymlinkOrCopyPublisher(object):
 
@@ -51,24 +53,22 @@ class SymlinkOrCopyPublisher(object):
                 'url': media.public_url
             })
 
-        selector = VolumeSelector()
-        volume = selector.backend_for(selector.scheme(media.private_url))()
+        volume = get_volume(media.private_url)
 
-        try:
-            private_path = volume.path(media.private_url)
-            symlink = True
-        except NotImplementedError:
-            with volume.open(media.private_url) as f:
-                private_path = self._local_copy(f)
-            symlink = False
-
-        # check that the publication path doesn't override an existing file
+        # segmented media (see ``SegmentedFFmpeg``) are published along with their segments,
+        # which keep their names next to the published manifest
         publication_path = safe_join(self.root, public_name)
-        if os.path.exists(publication_path):
-            raise ValueError("The publication path is not available.")
+        directory = os.path.dirname(publication_path)
+        files = [(media.private_url, publication_path)]
+        for name in segment_names(media):
+            files.append((name, safe_join(directory, name.rsplit('/', 1)[-1])))
+
+        # check that the publication paths don't override existing files
+        for name, path in files:
+            if os.path.lexists(path):
+                raise ValueError("The publication path is not available.")
 
         # create any intermediate directories to the publication path that do not exist
-        directory = os.path.dirname(publication_path)
         if not os.path.exists(directory):
             try:
                 if self.directory_permissions_mode is not None:
@@ -87,11 +87,8 @@ class SymlinkOrCopyPublisher(object):
         if not os.path.isdir(directory):
             raise IOError("%s exists and is not a directory." % directory)
 
-        # create a symlink or a copy to the file being published
-        if symlink:
-            os.symlink(private_path, publication_path)
-        else:
-            os.rename(private_path, publication_path)
+        for name, path in files:
+            self._publish_file(volume, name, path)
 
         # compute and return publication url
         media.public_url = urljoin(self.base_url, public_name)
@@ -101,23 +98,42 @@ class SymlinkOrCopyPublisher(object):
     def unpublish(self, media):
         public_name = media.public_url.replace(self.base_url, '', 1)
         publication_path = safe_join(self.root, public_name)
-        if not os.path.exists(publication_path):
+        if not os.path.lexists(publication_path):
             raise ValueError("%(media)s not found among the publication paths" % {
                 'media': str(media)
             })
 
         os.remove(publication_path)
+        directory = os.path.dirname(publication_path)
+        for name in segment_names(media):
+            path = safe_join(directory, name.rsplit('/', 1)[-1])
+            if os.path.lexists(path):
+                os.remove(path)
+
         media.public_url = ''
         media.save()
 
-    def _local_copy(self, content):
+    def _publish_file(self, volume, name, publication_path):
+        """Publishes the file ``name`` of ``volume`` at ``publication_path``."""
+        try:
+            # local copies of cached volumes may be evicted, hence they're copied
+            if volume.cached_paths:
+                raise NotImplementedError()
+            os.symlink(volume.path(name), publication_path)
+        except NotImplementedError:
+            # stage the copy in the publication directory so that it's renamed atomically
+            with volume.open(name) as f:
+                os.rename(self._local_copy(f, os.path.dirname(publication_path)),
+                    publication_path)
+
+    def _local_copy(self, content, directory=None):
         """
-        Saves ``content`` to a local temporary file and returns its name; ``content`` should be a
-        proper python file-like object.
+        Saves ``content`` to a local temporary file, in ``directory`` if provided, and returns its
+        name; ``content`` should be a proper python file-like object.
         """
-        (fd, tmp_name) = tempfile.mkstemp()
+        (fd, tmp_name) = tempfile.mkstemp(dir=directory, prefix='.')
         with open(fd, 'wb') as tmp_file:
-            shutil.copyfileobj(content, tmp_file)
+            copy_fileobj(content, tmp_file)
         return tmp_name
 
 class PublisherSelector(object):
@@ -0,0 +1,173 @@
+# This source file is part of django-meho
+# Main Developer : Dimitri Racordon (kyouko.taiga@gmail.com)
+#
+# Copyright 2013 Dimitri Racordon
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib, logging, os
+import shlex, tempfile
+import meho.settings as meho_settings
+
+from django.db import transaction
+from meho.core.encoders import load_encoder
+from meho.core.volumes import get_volume
+from meho.core.volumes.filesystem import copy_fileobj
+from meho.models import Metadata
+
+logger = logging.getLogger('meho')
+
+# prefix of the names of the metadata rows holding the content hash of a media
+CONTENT_PREFIX = 'content.'
+
+def content_hash(media, volume=None):
+    """
+    Returns the SHA-256 hex digest of the content of ``media``.
+
+    As for probe results, the digest is persisted as metadata of the media along with the
+    identity of the hashed file, so that the file is only read again if it has changed.
+    """
+    if volume is None:
+        volume = get_volume(media.private_url)
+
+    try:
+        identity = volume.identity(media.private_url)
+    except NotImplementedError:
+        identity = None
+
+    if identity is not None:
+        stored = dict(Metadata.objects.filter(media=media, name__startswith=CONTENT_PREFIX)
+            .values_list('name', 'content'))
+        if stored.get(CONTENT_PREFIX + 'identity') == identity:
+            return stored.get(CONTENT_PREFIX + 'sha256')
+
+    digest = hashlib.sha256()
+    with volume.open(media.private_url) as f:
+        for chunk in iter(lambda: f.read(1048576), b''):
+            digest.update(chunk)
+    digest = digest.hexdigest()
+
+    if identity is not None:
+        with transaction.atomic():
+            Metadata.objects.filter(media=media, name__startswith=CONTENT_PREFIX).delete()
+            Metadata.objects.bulk_create([
+                Metadata(media=media, name=CONTENT_PREFIX + 'identity', content=identity),
+                Metadata(media=media, name=CONTENT_PREFIX + 'sha256', content=digest)
+            ])
+    return digest
+
+def result_key(media_in, media_out, encoder, encoder_string):
+    """
+    Returns the key under which the result of transcoding ``media_in`` into ``media_out`` is
+    cached.
+
+    The key covers the content of the input, the encoder class, the encoder string (ignoring
+    differences of quoting and whitespace) and the extension of the output, from which ffmpeg
+    guesses the output format; the urns and urls of both media don't matter.
+    """
+    digest = content_hash(media_in)
+    encoder = meho_settings.MEHO_ENCODERS.get(encoder, encoder)
+    encoder_string = ' '.join(shlex.quote(arg) for arg in shlex.split(encoder_string))
+    suffix = os.path.splitext(get_volume(media_out.private_url).filename(
+        media_out.private_url))[1].lower()
+
+    key = '\0'.join((digest, encoder, encoder_string, suffix))
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+def fetch_result(media_in, media_out, encoder, encoder_string):
+    """
+    Saves the cached result of transcoding ``media_in`` with ``encoder`` and ``encoder_string``
+    to the private url of ``media_out`` and marks it as ready; returns whether the result was
+    found in the cache. Always returns ``False`` if ``MEHO_RESULT_CACHE_ROOT`` isn't set.
+    """
+    if not meho_settings.MEHO_RESULT_CACHE_ROOT or not caches_results(encoder):
+        return False
+
+    key = result_key(media_in, media_out, encoder, encoder_string)
+    filename = os.path.join(meho_settings.MEHO_RESULT_CACHE_ROOT, key)
+    try:
+        f = open(filename, 'rb')
+    except FileNotFoundError:
+        return False
+    with f:
+        # mark the entry as recently used
+        os.utime(filename)
+        get_volume(media_out.private_url).save(media_out.private_url, f)
+
+    media_out.status = 'ready'
+    media_out.save()
+    logger.info('transcoding %s into %s satisfied from the result cache' % (media_in, media_out))
+    return True
+
+def store_result(media_in, media_out, encoder, encoder_string):
+    """
+    Copies the transcoded ``media_out`` to the result cache, then evicts the least recently
+    used results while the cache exceeds ``MEHO_RESULT_CACHE_SIZE`` bytes.
+    """
+    root = meho_settings.MEHO_RESULT_CACHE_ROOT
+    if not root or not caches_results(encoder):
+        return
+
+    key = result_key(media_in, media_out, encoder, encoder_string)
+    os.makedirs(root, exist_ok=True)
+
+    # write to a temporary file first so that readers never see a partial result
+    fd, tmp_name = tempfile.mkstemp(dir=root, prefix='.')
+    try:
+        with open(fd, 'wb') as dst, \
+                get_volume(media_out.private_url).open(media_out.private_url) as src:
+            copy_fileobj(src, dst)
+        os.replace(tmp_name, os.path.join(root, key))
+    except Exception:
+        os.remove(tmp_name)
+        raise
+
+    evict_results()
+
+def evict_results(size=None):
+    """
+    Removes the least recently used results until the result cache holds at most ``size``
+    bytes (defaults to ``MEHO_RESULT_CACHE_SIZE``).
+    """
+    root = meho_settings.MEHO_RESULT_CACHE_ROOT
+    if size is None:
+        size = meho_settings.MEHO_RESULT_CACHE_SIZE
+
+    entries = []
+    for name in os.listdir(root):
+        if name.startswith('.'):
+            # results being written
+            continue
+        try:
+            stat = os.stat(os.path.join(root, name))
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, name))
+
+    total = sum(entry[1] for entry in entries)
+    for mtime, entry_size, name in sorted(entries):
+        if total <= size:
+            break
+        try:
+            os.remove(os.path.join(root, name))
+        except FileNotFoundError:
+            pass
+        total -= entry_size
+
+def caches_results(encoder):
+    """
+    Returns whether the results of ``encoder`` can be cached; encoders whose results don't fit
+    in a single file set their ``cache_results`` attribute to ``False``.
+    """
+    encoder_class = load_encoder(meho_settings.MEHO_ENCODERS[encoder])
+    return getattr(encoder_class, 'cache_results', True)
@@ -15,16 +15,23 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import importlib, threading
 import meho.settings as meho_settings
 
 from django.core.exceptions import ImproperlyConfigured
+from django.dispatch import receiver
 from django.utils.module_loading import import_by_path
+try:
+    from django.core.signals import setting_changed
+except ImportError:
+    from django.test.signals import setting_changed
 try:
     from urllib import parse as urlparse
 except:
     import urlparse
 
 from meho.core.volumes.base import VolumeDriver
+from meho.core.volumes.cached import CachedVolumeDriver, cached_backend
 from meho.core.volumes.filesystem import FileSystemVolumeDriver, TemporaryVolumeDriver
 from meho.core.volumes.webdav import WebdavVolumeDriver
 
@@ -32,11 +39,10 @@ class VolumeSelector(object):
 
     def __init__(self, backends=None):
         if not backends:
-            backends = meho_settings.MEHO_VOLUME_BACKENDS
-        self.backends = {}
-
-        for scheme, backend in backends.items():
-            self.backends[scheme] = import_by_path(backend)
+            # configured backends are only resolved once per process
+            self.backends = get_backends()
+        else:
+            self.backends = resolve_backends(backends)
 
     def scheme(self, name):
         """
@@ -50,5 +56,66 @@ class VolumeSelector(object):
         """
         if scheme not in self.backends:
             raise ImproperlyConfigured(
-                'No volume driver set for "%(scheme)s".' % {'scheme': sheme})
+                'No volume driver set for "%(scheme)s".' % {'scheme': scheme})
         return self.backends[scheme]
+
+_backends = None
+_volumes = {}
+_registry_lock = threading.RLock()
+
+def resolve_backends(backends):
+    """
+    Returns a dictionary mapping schemes to the volume driver classes named by ``backends``,
+    wrapping those of the schemes listed in ``MEHO_VOLUME_CACHE_SCHEMES``.
+    """
+    resolved = {}
+    for scheme, backend in backends.items():
+        resolved[scheme] = import_by_path(backend)
+        if scheme in meho_settings.MEHO_VOLUME_CACHE_SCHEMES:
+            resolved[scheme] = cached_backend(resolved[scheme])
+    return resolved
+
+def get_backends():
+    """Returns the volume driver classes configured by ``MEHO_VOLUME_BACKENDS``, by scheme."""
+    global _backends
+    backends = _backends
+    if backends is None:
+        with _registry_lock:
+            if _backends is None:
+                _backends = resolve_backends(meho_settings.MEHO_VOLUME_BACKENDS)
+            backends = _backends
+    return backends
+
+def get_volume(name):
+    """
+    Returns the volume driver handling the file specified by ``name``.
+
+    Drivers are shared by all threads of the process, one per scheme and origin, so that their
+    state (e.g. the connections and authentication handlers of WebDAV drivers) is reused across
+    operations.
+    """
+    parts = urlparse.urlsplit(name)
+    key = (parts.scheme, parts.hostname, parts.port)
+    try:
+        return _volumes[key]
+    except KeyError:
+        pass
+
+    with _registry_lock:
+        if key not in _volumes:
+            _volumes[key] = VolumeSelector().backend_for(parts.scheme)()
+        return _volumes[key]
+
+def reset_volumes():
+    """Forgets the resolved backends and shared drivers; they're created again on next use."""
+    global _backends
+    with _registry_lock:
+        _backends = None
+        _volumes.clear()
+
+@receiver(setting_changed)
+def _on_setting_changed(setting, **kwargs):
+    if setting.startswith('MEHO_'):
+        # meho settings are read once, when ``meho.settings`` is imported
+        importlib.reload(meho_settings)
+        reset_volumes()
@@ -22,6 +22,10 @@ except:
 
 class VolumeDriver(object):
 
+    # whether paths returned by ``path`` are local copies of the files, which can't be written
+    # to and may disappear (see ``CachedVolumeDriver``)
+    cached_paths = False
+
     @property
     def volume_scheme(self):
         raise NotImplementedError()
@@ -106,6 +110,14 @@ class VolumeDriver(object):
         """
         raise NotImplementedError()
 
+    def identity(self, name):
+        """
+        Returns a string that changes whenever the content of the file specified by ``name``
+        changes (e.g. its size and modification time, or its ETag). Volume drivers that can't
+        identify file versions should *not* implement this method.
+        """
+        raise NotImplementedError("This backend doesn't support file identities.")
+
     def path(self, name):
         """
         Returns a local filesystem path where the file specified by ``name`` can be retrieved using
@@ -0,0 +1,204 @@
+# This source file is part of django-meho
+# Main Developer : Dimitri Racordon (kyouko.taiga@gmail.com)
+#
+# Copyright 2013 Dimitri Racordon
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib, logging, os
+import tempfile, threading, time
+import meho.settings as meho_settings
+
+from meho.core.volumes.base import VolumeDriver
+from meho.core.volumes.filesystem import copy_fileobj
+
+logger = logging.getLogger('meho')
+
+# serializes the downloads of the same file by the threads of this process; files are spread
+# over a fixed number of locks so that the set of locks doesn't grow with the cache
+_fetch_locks = [threading.Lock() for i in range(64)]
+
+class CachedVolumeDriver(VolumeDriver):
+    """
+    A volume driver keeping local copies of the files read from another volume driver, so that
+    files read several times (e.g. probed, transcoded, then published) are only downloaded
+    once, and exposing them through ``path``.
+
+    Copies are stored in ``MEHO_VOLUME_CACHE_ROOT`` along with the identity of the file they
+    were made from; they're checked against the identity reported by the wrapped volume (e.g.
+    the ETag of a WebDAV resource) on every access, and downloaded again if the file changed.
+    The least recently used copies are evicted when the cache exceeds
+    ``MEHO_VOLUME_CACHE_SIZE`` bytes, except those returned by ``path`` within the last
+    ``MEHO_VOLUME_CACHE_GRACE`` seconds, which may still be opened by their users. Files of
+    volumes that can't identify file versions are never cached.
+
+    Use ``cached_backend`` to wrap a volume driver class, or list its scheme in
+    ``MEHO_VOLUME_CACHE_SCHEMES``.
+    """
+
+    # paths returned by ``path`` are copies that can't be written to, and may be evicted
+    cached_paths = True
+
+    # class of the wrapped volume driver, set by ``cached_backend``
+    backend_class = None
+
+    def __init__(self, volume=None):
+        self.volume = volume if volume is not None else self.backend_class()
+
+    @property
+    def volume_scheme(self):
+        return self.volume.volume_scheme
+
+    def filename(self, name):
+        return self.volume.filename(name)
+
+    def next_available_name(self):
+        return self.volume.next_available_name()
+
+    def open(self, name, mode='rb'):
+        if 'w' in mode or 'a' in mode or '+' in mode:
+            self._invalidate(name)
+            return self.volume.open(name, mode)
+        try:
+            return open(self.path(name), 'rb')
+        except NotImplementedError:
+            return self.volume.open(name, mode)
+
+    def save(self, name, content):
+        self._invalidate(name)
+        self.volume.save(name, content)
+
+    def delete(self, name):
+        self._invalidate(name)
+        self.volume.delete(name)
+
+    def exists(self, name):
+        return self.volume.exists(name)
+
+    def listdir(self, path):
+        return self.volume.listdir(path)
+
+    def identity(self, name):
+        return self.volume.identity(name)
+
+    def url(self, name):
+        return self.volume.url(name)
+
+    def path(self, name):
+        """
+        Returns the path of an up-to-date local copy of the file specified by ``name``,
+        downloading it if required. The copy must not be modified.
+        """
+        identity = self.volume.identity(name)
+        filename = self._cache_filename(name)
+
+        with _fetch_lock(filename):
+            if _read_identity(filename) != identity:
+                self._fetch(name, filename, identity)
+            try:
+                # mark the copy as recently used
+                os.utime(filename)
+            except FileNotFoundError:
+                # the copy was evicted by another process in between
+                self._fetch(name, filename, identity)
+        return filename
+
+    def _fetch(self, name, filename, identity):
+        root = meho_settings.MEHO_VOLUME_CACHE_ROOT
+        os.makedirs(root, exist_ok=True)
+        logger.info('caching %s' % self._key(name))
+
+        # download to a temporary file first so that readers never see a partial copy
+        fd, tmp_name = tempfile.mkstemp(dir=root, prefix='.')
+        try:
+            with open(fd, 'wb') as dst, self.volume.open(name, 'rb') as src:
+                copy_fileobj(src, dst)
+            os.replace(tmp_name, filename)
+        except:
+            os.remove(tmp_name)
+            raise
+        with open(filename + '.identity', 'w') as f:
+            f.write(identity)
+
+        evict_cached_files(keep=filename)
+
+    def _invalidate(self, name):
+        filename = self._cache_filename(name)
+        for path in (filename + '.identity', filename):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _cache_filename(self, name):
+        return os.path.join(meho_settings.MEHO_VOLUME_CACHE_ROOT,
+            hashlib.sha256(self._key(name).encode('utf-8')).hexdigest())
+
+    def _key(self, name):
+        # credentials don't take part in the identity of files
+        try:
+            return self.volume.url(name)
+        except NotImplementedError:
+            return name
+
+def cached_backend(backend_class):
+    """Returns a volume driver class caching the files read from ``backend_class`` drivers."""
+    return type('Cached' + backend_class.__name__, (CachedVolumeDriver,), {
+        'backend_class': backend_class
+    })
+
+def evict_cached_files(size=None, keep=None):
+    """
+    Removes the least recently used local copies until the cache holds at most ``size`` bytes
+    (defaults to ``MEHO_VOLUME_CACHE_SIZE``), keeping ``keep`` and the copies used within the
+    last ``MEHO_VOLUME_CACHE_GRACE`` seconds in any case.
+    """
+    root = meho_settings.MEHO_VOLUME_CACHE_ROOT
+    if size is None:
+        size = meho_settings.MEHO_VOLUME_CACHE_SIZE
+    in_use = time.time() - meho_settings.MEHO_VOLUME_CACHE_GRACE
+
+    entries = []
+    for name in os.listdir(root):
+        if name.startswith('.') or name.endswith('.identity'):
+            # copies being downloaded, and identities
+            continue
+        try:
+            stat = os.stat(os.path.join(root, name))
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+
+    total = sum(entry[1] for entry in entries)
+    for mtime, entry_size, filename in sorted(entries):
+        if total <= size:
+            break
+        if filename == keep or mtime > in_use:
+            continue
+        for path in (filename + '.identity', filename):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        total -= entry_size
+
+def _read_identity(filename):
+    try:
+        with open(filename + '.identity') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def _fetch_lock(filename):
+    # cache filenames are hex digests
+    return _fetch_locks[int(os.path.basename(filename)[:8], 16) % len(_fetch_locks)]
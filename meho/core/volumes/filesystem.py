@@ -15,9 +15,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import errno, os, shutil, tempfile, uuid
+import errno, io, os, shutil
+import stat, tempfile, uuid
 import meho.settings as meho_settings
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 from django.utils._os import safe_join
 from meho.core.volumes.base import VolumeDriver
 
@@ -33,11 +39,6 @@ class FileSystemVolumeDriver(VolumeDriver):
     def save(self, name, content):
         assert name, 'The name argument is not allowed to be empty.'
 
-        # write content to a temporary file
-        (fd, tmp_name) = tempfile.mkstemp()
-        with open(fd, 'wb') as tmp_file:
-            shutil.copyfileobj(content, tmp_file)
-
         # try to create a directory for the location specified by name if required
         full_path = self.path(name)
         directory = os.path.dirname(full_path)
@@ -50,8 +51,16 @@ class FileSystemVolumeDriver(VolumeDriver):
         if not os.path.isdir(directory):
             raise IOError('%s exists and is not a directory.' % directory)
 
-        # move the temporary file to the location specified by name
-        os.rename(tmp_name, full_path)
+        # write content to a temporary file staged next to the location specified by name, so
+        # that it's moved there atomically without crossing filesystems
+        (fd, tmp_name) = tempfile.mkstemp(dir=directory, prefix='.', suffix='.part')
+        try:
+            with open(fd, 'wb') as tmp_file:
+                copy_fileobj(content, tmp_file)
+            os.replace(tmp_name, full_path)
+        except:
+            os.remove(tmp_name)
+            raise
 
     def delete(self, name):
         assert name, 'The name argument is not allowed to be empty.'
@@ -81,6 +90,10 @@ class FileSystemVolumeDriver(VolumeDriver):
                 files.append(entry)
         return directories, files
 
+    def identity(self, name):
+        stat = os.stat(self.path(name))
+        return '%i:%i' % (stat.st_size, stat.st_mtime_ns)
+
     def path(self, name):
         return self.filename(name)
 
@@ -95,3 +108,75 @@ class TemporaryVolumeDriver(FileSystemVolumeDriver):
 
     def path(self, name):
         return safe_join(self.root, self.filename(name).lstrip('/'))
+
+# ioctl cloning a file on copy-on-write filesystems (e.g. btrfs or xfs), see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+def copy_fileobj(src, dst):
+    """
+    Copies the content of the file object ``src``, from its current position, to the file
+    object ``dst``.
+
+    If both are regular files, the content is copied by the kernel rather than through python
+    buffers: the file is cloned if the filesystem supports it, otherwise copied with
+    ``copy_file_range`` or ``sendfile``; ``shutil.copyfileobj`` is used as a fallback.
+    """
+    try:
+        src_fd, dst_fd = src.fileno(), dst.fileno()
+        regular = stat.S_ISREG(os.fstat(src_fd).st_mode) and stat.S_ISREG(os.fstat(dst_fd).st_mode)
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        regular = False
+
+    if regular:
+        dst.flush()
+        src_offset, dst_offset = src.tell(), dst.tell()
+        copied = _copy_range(src_fd, dst_fd, src_offset, dst_offset,
+            os.fstat(src_fd).st_size - src_offset)
+        src.seek(src_offset + copied)
+        dst.seek(dst_offset + copied)
+
+    # copy whatever couldn't be copied by the kernel
+    shutil.copyfileobj(src, dst, 1048576)
+
+def _copy_range(src_fd, dst_fd, src_offset, dst_offset, size):
+    """
+    Copies up to ``size`` bytes between two file descriptors at the given offsets without
+    moving data through user space; returns the number of bytes copied, possibly less than
+    ``size`` if the kernel can't copy between these files.
+    """
+    if size <= 0:
+        return 0
+
+    if fcntl is not None and src_offset == 0 and dst_offset == 0 and \
+            os.fstat(dst_fd).st_size == 0:
+        try:
+            fcntl.ioctl(dst_fd, FICLONE, src_fd)
+            return size
+        except OSError:
+            pass
+
+    copied = 0
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while copied < size:
+                n = os.copy_file_range(src_fd, dst_fd, size - copied,
+                    src_offset + copied, dst_offset + copied)
+                if n == 0:
+                    break
+                copied += n
+            return copied
+        except OSError:
+            # e.g. the files are on different filesystems on older kernels
+            pass
+
+    if hasattr(os, 'sendfile'):
+        try:
+            os.lseek(dst_fd, dst_offset + copied, os.SEEK_SET)
+            while copied < size:
+                n = os.sendfile(dst_fd, src_fd, src_offset + copied, size - copied)
+                if n == 0:
+                    break
+                copied += n
+        except OSError:
+            pass
+    return copied
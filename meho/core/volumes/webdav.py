@@ -15,12 +15,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import re, requests, tempfile
+import hashlib, io, json, logging
+import os, re, requests, shutil
+import tempfile, threading, time
 import meho.settings as meho_settings
 
-from django.core.exceptions import ImproperlyConfigured
+from concurrent.futures import ThreadPoolExecutor
 from django.core.files.base import File
-from django.utils.module_loading import import_by_path
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 from meho.core.volumes.base import VolumeDriver
 from meho.auth.backends import AutoAuth
 from meho.models import Credentials
@@ -31,6 +34,8 @@ except:
     import StringIO
     import urlparse
 
+logger = logging.getLogger('meho')
+
 class WebdavVolumeDriver(VolumeDriver):
 
     def __init__(self, identities=None):
@@ -43,6 +48,10 @@ class WebdavVolumeDriver(VolumeDriver):
 
     def open(self, name, mode='r'):
         assert name, 'The name argument is not allowed to be empty.'
+        if 'w' not in mode and 'a' not in mode and '+' not in mode:
+            # remote files are read lazily as they're consumed
+            return io.BufferedReader(WebdavReader(self, name),
+                meho_settings.MEHO_WEBDAV_READ_BUFFER)
         return WebdavFileWrapper(self, name, mode)
 
     def save(self, name, content):
@@ -62,72 +71,296 @@ class WebdavVolumeDriver(VolumeDriver):
             return False
         return True
 
+    def identity(self, name):
+        assert name, 'The name argument is not allowed to be empty.'
+        headers = self._head(name).headers
+        if 'etag' in headers:
+            return headers['etag']
+        if 'last-modified' in headers:
+            return '%s:%s' % (headers.get('content-length', ''), headers['last-modified'])
+        raise NotImplementedError("The server doesn't expose any validator for %s." % name)
+
     def url(self, name):
         return re.sub(r'\/\/.*:?.*@', '//', name)
 
     def _read(self, name):
-        # first try to get resource without any authentication
-        req = self._retry_if_auth('GET', name)
-
+        # download the whole file, which is only needed to append content to it
         temporary_file = tempfile.SpooledTemporaryFile(max_size=10485760)
-        for chunk in req.iter_content(chunk_size=1024):
-            if chunk:
-                temporary_file.write(chunk)
-                temporary_file.flush()
+        with self.open(name, 'rb') as f:
+            shutil.copyfileobj(f, temporary_file, meho_settings.MEHO_WEBDAV_READ_BUFFER)
         temporary_file.seek(0)
         return temporary_file
 
     def _write(self, name, content):
-        req = self._retry_if_auth('PUT', name, data=content)
+        try:
+            position = content.tell()
+        except (AttributeError, OSError, ValueError):
+            position = None
+
+        chunk_size = meho_settings.MEHO_WEBDAV_CHUNK_SIZE
+        if chunk_size and position is not None:
+            size = content.seek(0, 2) - position
+            content.seek(position)
+            if size > chunk_size:
+                return self._write_chunked(name, content, position, size)
+
+        if position is None:
+            # the content can't be sent twice, hence the collections have to exist beforehand
+            self._make_collections(name)
+        try:
+            self._retry_if_auth('PUT', name, data=content)
+        except requests.HTTPError as e:
+            # 409 Conflict means that the parent collection doesn't exist
+            if position is None or e.response.status_code != 409:
+                raise
+            self._make_collections(name)
+            content.seek(position)
+            self._retry_if_auth('PUT', name, data=content)
+
+    def _write_chunked(self, name, content, position, size):
+        """
+        Uploads ``size`` bytes of ``content``, starting at ``position``, with ``Content-Range``
+        PUT requests of ``MEHO_WEBDAV_CHUNK_SIZE`` bytes, ``MEHO_WEBDAV_UPLOAD_WORKERS`` of
+        them being sent in parallel.
+
+        Chunks are written to a partial resource next to ``name``, moved over ``name`` once its
+        size has been checked. Acknowledged chunks are recorded in a local journal along with
+        their SHA-256 digest, so that an interrupted upload of the same file resumes with the
+        missing chunks; chunks whose content changed since are uploaded again. Failed chunks are
+        retried up to ``MEHO_WEBDAV_RETRIES`` times.
+        """
+        chunk_size = meho_settings.MEHO_WEBDAV_CHUNK_SIZE
+        chunks = [(start, min(start + chunk_size, size))
+            for start in range(0, size, chunk_size)]
+        partial_name = name + '.part'
+        lock = threading.Lock()
+
+        def read_chunk(index):
+            start, end = chunks[index]
+            with lock:
+                content.seek(position + start)
+                return content.read(end - start)
+
+        journal_name = os.path.join(meho_settings.MEHO_TEMP_ROOT, 'meho-upload-%s.json' %
+            hashlib.sha1(self.url(name).encode('utf-8')).hexdigest())
+        journal = {'size': size, 'chunk_size': chunk_size, 'done': {}}
+        try:
+            with open(journal_name) as f:
+                stored = json.load(f)
+            if (stored['size'], stored['chunk_size']) == (size, chunk_size) and \
+                    self.exists(partial_name):
+                # the partial resource may have been written from another file of the same size
+                journal['done'] = {index: digest for index, digest in stored['done'].items()
+                    if hashlib.sha256(read_chunk(int(index))).hexdigest() == digest}
+                logger.info('resuming upload of %s: %i of %i chunks done' % (
+                    self.url(name), len(journal['done']), len(chunks)))
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+
+        if not journal['done']:
+            self._make_collections(name)
+            try:
+                self._delete(partial_name)
+            except requests.HTTPError:
+                pass
+
+        def upload(index):
+            data = read_chunk(index)
+            start, end = chunks[index]
+            headers = {'Content-Range': 'bytes %i-%i/%i' % (start, end - 1, size)}
+            for attempt in range(meho_settings.MEHO_WEBDAV_RETRIES + 1):
+                try:
+                    self._retry_if_auth('PUT', partial_name, data=data, headers=headers)
+                    break
+                except requests.RequestException:
+                    if attempt == meho_settings.MEHO_WEBDAV_RETRIES:
+                        raise
+                    time.sleep(meho_settings.MEHO_WEBDAV_BACKOFF * 2 ** attempt)
+
+            with lock:
+                journal['done'][str(index)] = hashlib.sha256(data).hexdigest()
+                _write_journal(journal_name, journal)
+
+        pending = [index for index in range(len(chunks)) if str(index) not in journal['done']]
+        with ThreadPoolExecutor(meho_settings.MEHO_WEBDAV_UPLOAD_WORKERS) as executor:
+            # consume the results to propagate the first error
+            for result in executor.map(upload, pending):
+                pass
+
+        # check the integrity of the upload before replacing the previous content of the file
+        uploaded = int(self._head(partial_name).headers.get('content-length', -1))
+        if uploaded != size:
+            os.remove(journal_name)
+            raise IOError('Upload of %s is corrupted: %i bytes were uploaded out of %i.' % (
+                self.url(name), uploaded, size))
+
+        self._retry_if_auth('MOVE', partial_name,
+            headers={'Destination': self.url(name), 'Overwrite': 'T'})
+        os.remove(journal_name)
+
+    def _make_collections(self, name):
+        # create any intermediate collection that does not exist; servers reply with 405 Method
+        # Not Allowed to MKCOL requests on existing collections
+        parts = urlparse.urlsplit(self.url(name))
+        base_url = '%s://%s/' % (parts.scheme, parts.netloc)
+        for directory in self.filename(name).split('/')[1:-1]:
+            base_url = urlparse.urljoin(base_url, directory + '/')
+            try:
+                self._retry_if_auth('MKCOL', base_url)
+            except requests.HTTPError as e:
+                if e.response.status_code != 405:
+                    raise
 
     def _delete(self, name):
         req = self._retry_if_auth('DELETE', name)
 
     def _head(self, name):
-        req = self._retry_if_auth('HEAD', name)
+        return self._retry_if_auth('HEAD', name)
 
-        for directory in file_path.split('/')[1:-1]:
-            base_url = urlparse.urljoin(base_url, directory + '/')
-            if not self.exists(base_url):
-                requests.request('MKCOL', base_url, auth=self.auth_handler)
-
-        # if server returned 401, retry with authentication credentials
-        if req.status_code == 401:
-            kwargs['auth'] = self._get_auth_handler(name, req)
-            req = requests.request(method, url, **kwargs)
-        if req.status_code != 200:
-            req.raise_for_status()
+    def _retry_if_auth(self, method, name, **kwargs):
+        # the auth handler retries the request with authentication credentials if the server
+        # returned 401
+        kwargs.setdefault('auth', self.auth_handler)
+        url = self.url(name)
+        req = get_session(url).request(method, url, **kwargs)
+        req.raise_for_status()
         return req
 
-    def _get_auth_handler(self, name, request):
-        auth_scheme = request.headers['WWW-Authenticate'].split(' ')[0].lower()
-        credentials = self.credentials(name)
-        origin = self.netloc(name)
+def _write_journal(journal_name, journal):
+    # write to a temporary file first so that an interrupted write never leaves a truncated
+    # journal behind
+    fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(journal_name), prefix='.')
+    try:
+        with open(fd, 'w') as f:
+            json.dump(journal, f)
+        os.replace(tmp_name, journal_name)
+    except:
+        os.remove(tmp_name)
+        raise
 
-        # format credentials into kwargs style if provided within the file name
-        if credentials is not None:
-            credentials = {'username': credentials[0], 'password': credentials[1]}
+_sessions = {}
+_sessions_lock = threading.Lock()
 
-        # if credentials are not provided within the file name, we try to get
-        # them from the credential manager
-        else:
-            try:
-                print 
-                credentials = self._credential_set.get(scheme=auth_scheme, origin=origin).data
-            except Credentials.DoesNotExist:
-                credentials = None
-
-        auth_class = meho_settings.MEHO_AUTH_BACKENDS.get(auth_scheme, None)
-        if credentials and auth_class:
-            return import_by_path(auth_class)(**credentials)
+def get_session(url):
+    """
+    Returns the HTTP session shared by all requests to the origin of ``url``, so that
+    connections are kept alive and reused across volume drivers and threads.
+
+    Each session keeps up to ``MEHO_WEBDAV_POOL_SIZE`` connections open, and retries idempotent
+    requests up to ``MEHO_WEBDAV_RETRIES`` times on connection errors and 502, 503 or 504
+    responses, waiting ``MEHO_WEBDAV_BACKOFF`` seconds (doubled after each retry) in between.
+    Uploads aren't retried since their content might not be sent twice.
+    """
+    parts = urlparse.urlsplit(url)
+    origin = (parts.scheme, parts.hostname, parts.port)
+    with _sessions_lock:
+        if origin not in _sessions:
+            adapter = HTTPAdapter(pool_connections=1,
+                pool_maxsize=meho_settings.MEHO_WEBDAV_POOL_SIZE, max_retries=_retry_policy())
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[origin] = session
+        return _sessions[origin]
+
+def _retry_policy():
+    kwargs = {
+        'total': meho_settings.MEHO_WEBDAV_RETRIES,
+        'backoff_factor': meho_settings.MEHO_WEBDAV_BACKOFF,
+        'status_forcelist': (502, 503, 504),
+        'raise_on_status': False
+    }
+    methods = frozenset(['HEAD', 'GET', 'OPTIONS', 'DELETE'])
+    try:
+        return Retry(allowed_methods=methods, **kwargs)
+    except TypeError:
+        # urllib3 < 1.26
+        return Retry(method_whitelist=methods, **kwargs)
+
+class WebdavReader(io.RawIOBase):
+    """
+    A read-only file object streaming the content of a remote file from the response to a GET
+    request, opened on first read. Seeking closes the response; the next read then opens a new
+    one with a ``Range`` request starting at the new position.
+    """
+
+    def __init__(self, volume_driver, name):
+        self._volume_driver = volume_driver
+        self._name = name
+        self._position = 0
+        self._size = None
+        self._response = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._get_size()
+        if offset < 0:
+            raise ValueError('Negative seek position %i.' % offset)
+        if offset != self._position:
+            self._close_response()
+            self._position = offset
+        return self._position
+
+    def readinto(self, b):
+        if self._size is not None and self._position >= self._size:
+            return 0
+        if self._response is None:
+            self._open_response()
+        # positions are offsets in the stored bytes, as Range offsets are
+        data = self._response.raw.read(len(b), decode_content=False)
+        b[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def close(self):
+        self._close_response()
+        super(WebdavReader, self).close()
+
+    def _open_response(self):
+        headers = {'Accept-Encoding': 'identity'}
+        if self._position:
+            headers['Range'] = 'bytes=%i-' % self._position
+        response = self._volume_driver._retry_if_auth('GET', self._name, headers=headers,
+            stream=True)
+
+        if response.status_code == 206:
+            # Content-Range: bytes <first>-<last>/<size>
+            size = response.headers.get('content-range', '').rpartition('/')[2]
+            if size.isdigit():
+                self._size = int(size)
         else:
-            raise ImproperlyConfigured(
-                'No authentication credentials for "%(origin)s" with scheme '
-                '"%(scheme)s". Either provide credentials within the file '
-                'name or set credentials for (%(origin)s, %(scheme)s).' % {
-                    'origin': origin,
-                    'scheme': auth_scheme
-                })
+            if 'content-length' in response.headers:
+                self._size = int(response.headers['content-length'])
+            # the server ignored the range, hence skip the content before the position
+            remaining = self._position
+            while remaining > 0:
+                skipped = len(response.raw.read(min(remaining, 1048576), decode_content=False))
+                if not skipped:
+                    break
+                remaining -= skipped
+        self._response = response
+
+    def _close_response(self):
+        if self._response is not None:
+            self._response.close()
+            self._response = None
+
+    def _get_size(self):
+        if self._size is None:
+            headers = self._volume_driver._head(self._name).headers
+            self._size = int(headers['content-length'])
+        return self._size
 
 class WebdavFileWrapper(object):
 
@@ -150,7 +383,18 @@ class WebdavFileWrapper(object):
                     self._file.seek(0,2)
         return getattr(self._file, name)
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     def close(self):
+        if self._file is None:
+            if 'w' not in self._mode:
+                # nothing was appended
+                return
+            self._file = io.BytesIO()
         self._file.seek(0)
         self._volume_driver._write(self._name, self._file)
         return self._file.close()
@@ -0,0 +1,151 @@
+# This source file is part of django-meho
+# Main Developer : Dimitri Racordon (kyouko.taiga@gmail.com)
+#
+# Copyright 2013 Dimitri Racordon
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging, os, socket, threading, time
+import meho.settings as meho_settings
+
+from django.db import close_old_connections
+from meho.core.encoders.supervisor import get_supervisor
+from meho.core.jobs import (claim_jobs, discard_work_path, heartbeat_jobs, recover_jobs,
+    release_jobs, run_jobs)
+
+logger = logging.getLogger('meho')
+
+# worker pool of the calling thread, set for the worker threads of pools
+_local = threading.local()
+
+class WorkerPool(object):
+    """
+    A fixed-size pool of worker threads draining the job table.
+
+    Jobs queued while all workers are busy wait in the job table instead of being started right
+    away, so that the number of concurrently running jobs never exceeds the size of the pool.
+    Several pools, possibly on different hosts, can drain the same job table.
+    """
+
+    def __init__(self, size=None, name=None):
+        if size is None:
+            size = meho_settings.MEHO_WORKERS or os.cpu_count() or 1
+        self.size = size
+        self.name = name or '%s:%i' % (socket.gethostname(), os.getpid())
+        self._threads = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._running = 0
+        self._stopping = False
+
+    def start(self):
+        with self._lock:
+            if not self._threads:
+                # resume the jobs left behind by dead workers, e.g. by a previous instance of
+                # this process
+                try:
+                    recover_jobs()
+                except Exception:
+                    logger.exception('could not recover orphaned jobs')
+
+                # jobs are kept alive by the pool rather than by their encoder, since encoders
+                # may spend a long time without reporting anything (e.g. while copying files)
+                t = threading.Thread(target=self._heartbeat, name='meho-heartbeat')
+                t.setDaemon(True)
+                t.start()
+            while len(self._threads) < self.size:
+                t = threading.Thread(target=self._work, name='meho-worker-%i' % len(self._threads))
+                t.setDaemon(True)
+                t.start()
+                self._threads.append(t)
+
+    def notify(self):
+        """Wakes idle workers up so that they look for newly queued jobs."""
+        self.start()
+        self._wakeup.set()
+
+    def stop(self):
+        """
+        Stops claiming jobs, queues the running jobs of the pool again and kills their ffmpeg
+        processes, so that other workers resume them right away while no process of this pool
+        keeps writing their outputs. The process should exit right after, since its worker
+        threads may still be finishing the released jobs.
+        """
+        self._stopping = True
+        # jobs are released before their processes are killed, so that their workers can't
+        # record them as failed in between
+        released = release_jobs(self.name)
+        get_supervisor().kill_all()
+        for job in released:
+            discard_work_path(job)
+        return released
+
+    def stats(self):
+        """Returns a dictionary describing the current load of the pool."""
+        return {
+            'workers': self.size,
+            'running': self._running
+        }
+
+    def _work(self):
+        _local.pool = self
+        worker = '%s/%s' % (self.name, threading.current_thread().name)
+        while not self._stopping:
+            try:
+                jobs = claim_jobs(worker)
+            except Exception:
+                logger.exception('worker [%s] could not claim a job' % worker)
+                jobs = []
+
+            if not jobs:
+                # sleep until a job is queued, but poll the job table from time to time since
+                # jobs may be queued by other processes
+                self._wakeup.wait(meho_settings.MEHO_WORKER_POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+
+            with self._lock:
+                self._running += 1
+            try:
+                run_jobs(jobs)
+            except Exception:
+                logger.exception('job [%s] failed' % ', '.join(job.task_id for job in jobs))
+            finally:
+                with self._lock:
+                    self._running -= 1
+                close_old_connections()
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(meho_settings.MEHO_JOB_HEARTBEAT_INTERVAL)
+            try:
+                heartbeat_jobs(self.name)
+            except Exception:
+                logger.exception('worker pool [%s] could not record its heartbeat' % self.name)
+            finally:
+                close_old_connections()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_worker_pool():
+    """Returns the process-wide worker pool, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = WorkerPool()
+        return _pool
+
+def current_worker_pool():
+    """Returns the worker pool running the calling thread, or ``None`` if it isn't a worker."""
+    return getattr(_local, 'pool', None)
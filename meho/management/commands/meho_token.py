@@ -0,0 +1,45 @@
+# This source file is part of django-meho
+# Main Developer : Dimitri Racordon (kyouko.taiga@gmail.com)
+#
+# Copyright 2013 Dimitri Racordon
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+from meho.models import ApiToken
+
+class Command(BaseCommand):
+
+    args = '<username>'
+    help = 'Creates an API token authenticating requests of a user and prints its key.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('-n', '--name', dest='name', default='',
+            help='Name describing the use of the token.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Usage: meho_token %s' % self.args)
+
+        user_model = get_user_model()
+        try:
+            user = user_model.objects.get(**{user_model.USERNAME_FIELD: args[0]})
+        except user_model.DoesNotExist:
+            raise CommandError('User "%s" does not exist.' % args[0])
+
+        key = ApiToken.generate(user, options['name'])
+        self.stdout.write('Token %s created for %s (it will not be shown again).' % (key, user))
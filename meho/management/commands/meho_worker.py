@@ -0,0 +1,52 @@
+# This source file is part of django-meho
+# Main Developer : Dimitri Racordon (kyouko.taiga@gmail.com)
+#
+# Copyright 2013 Dimitri Racordon
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import signal, time
+
+from django.core.management.base import BaseCommand
+from optparse import make_option
+from meho.core.workers import WorkerPool
+
+class Command(BaseCommand):
+
+    help = 'Runs queued transcoding jobs until interrupted.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('-w', '--workers', type='int', dest='workers', default=None,
+            help='Number of jobs run concurrently (defaults to MEHO_WORKERS).'),
+        make_option('-n', '--name', dest='name', default=None,
+            help='Name identifying this worker in the job table (defaults to host:pid).'),
+    )
+
+    def handle(self, *args, **options):
+        # stop on SIGTERM (e.g. from a service manager) as on an interrupt
+        signal.signal(signal.SIGTERM, interrupt)
+
+        pool = WorkerPool(size=options['workers'], name=options['name'])
+        pool.start()
+        self.stdout.write('Worker %s started with %i thread(s).' % (pool.name, pool.size))
+
+        try:
+            while True:
+                time.sleep(60)
+        except KeyboardInterrupt:
+            released = pool.stop()
+            self.stdout.write('Worker %s stopped, released %i job(s).' % (
+                pool.name, len(released)))
+
+def interrupt(signum, frame):
+    raise KeyboardInterrupt()
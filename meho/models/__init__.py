@@ -17,3 +17,5 @@
 
 from meho.models.credentials import Credentials
 from meho.models.media import Media, Metadata
+from meho.models.jobs import Job
+from meho.models.tokens import ApiToken
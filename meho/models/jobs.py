@@ -0,0 +1,59 @@
+# This source file is part of django-meho
+# Main Developer : Dimitri Racordon (kyouko.taiga@gmail.com)
+#
+# Copyright 2013 Dimitri Racordon
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import uuid
+
+from django.conf import settings
+from django.db import models
+from meho.models.media import Media
+
+def new_task_id():
+    return 'task_{0}'.format(uuid.uuid4().hex)
+
+class Job(models.Model):
+
+    task_id         = models.CharField(max_length=100, unique=True, default=new_task_id)
+    media_in        = models.ForeignKey(Media, related_name='+')
+    media_out       = models.ForeignKey(Media, related_name='jobs')
+    encoder         = models.CharField(max_length=100)
+    encoder_string  = models.TextField(blank=True)
+
+    # jobs of the same group share their input and are run together
+    group           = models.CharField(max_length=100, blank=True, db_index=True)
+
+    # jobs with a higher priority are run first; workers are shared fairly between owners
+    priority        = models.IntegerField(default=0)
+    owner           = models.ForeignKey(settings.AUTH_USER_MODEL, blank=True, null=True,
+                        related_name='+')
+
+    # one of 'queued', 'running', 'cancelling', 'done', 'failed' or 'cancelled'
+    status          = models.CharField(max_length=100, default='queued', db_index=True)
+    worker          = models.CharField(max_length=200, blank=True)
+    created         = models.DateTimeField(auto_now_add=True)
+    started         = models.DateTimeField(blank=True, null=True)
+    finished        = models.DateTimeField(blank=True, null=True)
+
+    # state of a running job, kept so that it can be recovered if its worker dies: the temporary
+    # output (or work directory) of its encoder, and the last heartbeat of its worker pool
+    work_path       = models.CharField(max_length=1000, blank=True)
+    progressed_at   = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return '{0} ({1})'.format(self.task_id, self.status)
+
+    class Meta:
+        app_label = 'meho'
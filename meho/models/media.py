@@ -46,11 +46,10 @@ class Media(models.Model):
     def clean(self):
         # try to guess the media type if not provided
         if not self.media_type and self.private_url:
-            from meho.core.volumes import VolumeSelector
+            from meho.core.volumes import get_volume
             from mimetypes import guess_type
 
-            selector = VolumeSelector()
-            volume = selector.backend_for(selector.scheme(self.private_url))()
+            volume = get_volume(self.private_url)
             mime, encoding = guess_type(volume.filename(self.private_url))
             if mime:
                 self.media_type = mime
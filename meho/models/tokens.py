@@ -0,0 +1,62 @@
+# This source file is part of django-meho
+# Main Developer : Dimitri Racordon (kyouko.taiga@gmail.com)
+#
+# Copyright 2013 Dimitri Racordon
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib, hmac, os
+
+from django.conf import settings
+from django.db import models
+
+class ApiToken(models.Model):
+    """
+    A token authenticating API requests of its user with the ``Token`` authorization scheme,
+    which unlike passwords can be verified without an expensive hash function. Only a digest of
+    the token is stored.
+    """
+
+    digest          = models.CharField(max_length=64, unique=True)
+    user            = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='+')
+    name            = models.CharField(max_length=200, blank=True)
+    created         = models.DateTimeField(auto_now_add=True)
+
+    @classmethod
+    def generate(cls, user, name=''):
+        """Creates a new token for ``user`` and returns its key, which can't be retrieved later."""
+        key = os.urandom(20).hex()
+        cls.objects.create(digest=cls.digest_key(key), user=user, name=name)
+        return key
+
+    @classmethod
+    def authenticate(cls, key):
+        """Returns the active user owning the token ``key``, or ``None``."""
+        digest = cls.digest_key(key)
+        try:
+            token = cls.objects.select_related('user').get(digest=digest)
+        except cls.DoesNotExist:
+            return None
+        if not hmac.compare_digest(token.digest, digest) or not token.user.is_active:
+            return None
+        return token.user
+
+    @staticmethod
+    def digest_key(key):
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def __str__(self):
+        return '{0} ({1})'.format(self.name or self.pk, self.user)
+
+    class Meta:
+        app_label = 'meho'
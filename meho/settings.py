@@ -15,13 +15,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+
 from django.conf import settings as django_settings
 from tempfile import gettempdir
 
-MEHO_DEFAULT_ENCODER = getattr(django_settings, 'MEHO_DEFAULT_ENCODER', 'meho.encoders.FFmpeg')
+MEHO_DEFAULT_ENCODER = getattr(django_settings, 'MEHO_DEFAULT_ENCODER', 'ffmpeg')
 
 MEHO_ENCODERS = getattr(django_settings, 'MEHO_ENCODERS', {
     'ffmpeg': 'meho.core.encoders.FFmpeg',
+    'ffmpeg-chunked': 'meho.core.encoders.ChunkedFFmpeg',
+    'ffmpeg-segmented': 'meho.core.encoders.SegmentedFFmpeg',
+    'thumbnails': 'meho.core.encoders.Thumbnails',
     'copy': 'meho.core.encoders.Copy'
 })
 
@@ -40,4 +45,124 @@ MEHO_AUTH_BACKENDS = getattr(django_settings, 'MEHO_AUTH_BACKENDS', {
     'digest': 'requests.auth.HTTPDigestAuth'
 })
 
+# number of authentication handlers kept per process by the handler authenticating requests
+# to remote volumes, and number of seconds their credentials are cached
+MEHO_AUTH_HANDLER_CACHE_SIZE = getattr(django_settings, 'MEHO_AUTH_HANDLER_CACHE_SIZE', 128)
+MEHO_CREDENTIALS_TTL = getattr(django_settings, 'MEHO_CREDENTIALS_TTL', 60)
+
+# number of verified API credentials kept per process by ``basic_http_auth``, and number of
+# seconds they're trusted without hashing the password again
+MEHO_API_AUTH_CACHE_SIZE = getattr(django_settings, 'MEHO_API_AUTH_CACHE_SIZE', 1024)
+MEHO_API_AUTH_CACHE_TTL = getattr(django_settings, 'MEHO_API_AUTH_CACHE_TTL', 60)
+
+# number of objects listed per page by the API when the request doesn't give a ``limit``, and
+# maximum number of objects listed per page
+MEHO_API_PAGE_SIZE = getattr(django_settings, 'MEHO_API_PAGE_SIZE', 100)
+MEHO_API_MAX_PAGE_SIZE = getattr(django_settings, 'MEHO_API_MAX_PAGE_SIZE', 1000)
+
+# number of objects fetched from the database at once while streaming lists of objects
+MEHO_API_CHUNK_SIZE = getattr(django_settings, 'MEHO_API_CHUNK_SIZE', 500)
+
 MEHO_TEMP_ROOT = getattr(django_settings, 'MEHO_TEMP_ROOT', gettempdir())
+
+# number of transcoding jobs run concurrently by each process (defaults to the number of CPUs)
+MEHO_WORKERS = getattr(django_settings, 'MEHO_WORKERS', None)
+
+# maximum number of jobs waiting for a free worker (0 means unbounded)
+MEHO_WORKER_QUEUE_SIZE = getattr(django_settings, 'MEHO_WORKER_QUEUE_SIZE', 0)
+
+# maximum number of jobs a single user can have running at once (0 means unbounded)
+MEHO_JOB_USER_CONCURRENCY = getattr(django_settings, 'MEHO_JOB_USER_CONCURRENCY', 0)
+
+# range of priorities users can give to their jobs; staff users can use any priority
+MEHO_JOB_PRIORITIES = getattr(django_settings, 'MEHO_JOB_PRIORITIES', (-10, 10))
+
+# number of queued jobs considered by each scheduling decision
+MEHO_SCHEDULER_WINDOW = getattr(django_settings, 'MEHO_SCHEDULER_WINDOW', 100)
+
+# number of seconds an idle worker waits before looking for new jobs
+MEHO_WORKER_POLL_INTERVAL = getattr(django_settings, 'MEHO_WORKER_POLL_INTERVAL', 5)
+
+# whether jobs are also run by a worker pool within the web processes; by default, they're only
+# run by dedicated ``manage.py meho_worker`` processes, so that web processes stay responsive
+MEHO_JOBS_IN_PROCESS = getattr(django_settings, 'MEHO_JOBS_IN_PROCESS', False)
+
+# minimum number of seconds between two writes of task progress to the cache
+MEHO_PROGRESS_INTERVAL = getattr(django_settings, 'MEHO_PROGRESS_INTERVAL', 1)
+
+# minimum change of progress (in percent) worth writing to the cache
+MEHO_PROGRESS_MIN_DELTA = getattr(django_settings, 'MEHO_PROGRESS_MIN_DELTA', 0.5)
+
+# number of seconds the status of queued or running tasks is kept in the cache after its last
+# update, and number of seconds the status of finished tasks is kept in the cache
+MEHO_TASK_TIMEOUT = getattr(django_settings, 'MEHO_TASK_TIMEOUT', 3600)
+MEHO_TASK_RETENTION = getattr(django_settings, 'MEHO_TASK_RETENTION', 86400)
+
+# number of segments long inputs are split into by the chunked ffmpeg encoder (defaults to the
+# number of CPUs per running job of the worker pool, so that jobs don't run more processes than
+# there are CPUs), and minimum duration (in seconds) of the inputs it splits
+MEHO_CHUNKED_SEGMENTS = getattr(django_settings, 'MEHO_CHUNKED_SEGMENTS', None)
+MEHO_CHUNKED_MIN_DURATION = getattr(django_settings, 'MEHO_CHUNKED_MIN_DURATION', 300)
+
+# whether ffmpeg reads inputs and writes outputs in streamable formats through pipes when they
+# aren't reachable through local paths, instead of copying them to temporary files
+MEHO_FFMPEG_STREAMING = getattr(django_settings, 'MEHO_FFMPEG_STREAMING', True)
+
+# limits applied to the processes of ffmpeg-based encoders, by encoder name; see the FFmpeg
+# encoder for the available limits, e.g. {'ffmpeg': {'timeout': 7200, 'nice': 10}}
+MEHO_ENCODER_LIMITS = getattr(django_settings, 'MEHO_ENCODER_LIMITS', {})
+
+# number of seconds without progress after which a ffmpeg process is considered hung and killed
+MEHO_FFMPEG_STALL_TIMEOUT = getattr(django_settings, 'MEHO_FFMPEG_STALL_TIMEOUT', 600)
+
+# number of seconds between two checks for the cancellation of a running job
+MEHO_CANCEL_POLL_INTERVAL = getattr(django_settings, 'MEHO_CANCEL_POLL_INTERVAL', 2)
+
+# number of seconds between two heartbeats recorded by worker pools for their running jobs
+MEHO_JOB_HEARTBEAT_INTERVAL = getattr(django_settings, 'MEHO_JOB_HEARTBEAT_INTERVAL', 30)
+
+# number of seconds without heartbeat after which a running job is considered orphaned by the
+# recovery pass run when a worker pool starts, and queued again
+MEHO_JOB_RECOVERY_TIMEOUT = getattr(django_settings, 'MEHO_JOB_RECOVERY_TIMEOUT', 900)
+
+# directory where transcoding results are cached, so that identical transcodes of the same
+# content are served without running the encoder again (None disables the cache), and maximum
+# size (in bytes) of the cache, beyond which the least recently used results are evicted
+MEHO_RESULT_CACHE_ROOT = getattr(django_settings, 'MEHO_RESULT_CACHE_ROOT', None)
+MEHO_RESULT_CACHE_SIZE = getattr(django_settings, 'MEHO_RESULT_CACHE_SIZE', 10 * 1024 ** 3)
+
+# duration (in seconds) of the segments of HLS and DASH renditions
+MEHO_SEGMENT_DURATION = getattr(django_settings, 'MEHO_SEGMENT_DURATION', 6)
+
+# number of frames tiled into the sprite sheets of the thumbnails encoder, number of columns of
+# sprite sheets and width (in pixels) of each frame
+MEHO_THUMBNAIL_FRAMES = getattr(django_settings, 'MEHO_THUMBNAIL_FRAMES', 100)
+MEHO_THUMBNAIL_COLUMNS = getattr(django_settings, 'MEHO_THUMBNAIL_COLUMNS', 10)
+MEHO_THUMBNAIL_WIDTH = getattr(django_settings, 'MEHO_THUMBNAIL_WIDTH', 160)
+
+# maximum number of connections kept alive per WebDAV server, number of times idempotent
+# requests to WebDAV servers are retried on transient errors, and delay (in seconds) before
+# the first retry, doubled after each retry
+MEHO_WEBDAV_POOL_SIZE = getattr(django_settings, 'MEHO_WEBDAV_POOL_SIZE', 10)
+MEHO_WEBDAV_RETRIES = getattr(django_settings, 'MEHO_WEBDAV_RETRIES', 3)
+MEHO_WEBDAV_BACKOFF = getattr(django_settings, 'MEHO_WEBDAV_BACKOFF', 0.5)
+
+# size (in bytes) of the chunks of uploads to WebDAV servers, sent with Content-Range PUT
+# requests (0 disables chunked uploads), and number of chunks uploaded in parallel
+MEHO_WEBDAV_CHUNK_SIZE = getattr(django_settings, 'MEHO_WEBDAV_CHUNK_SIZE', 0)
+MEHO_WEBDAV_UPLOAD_WORKERS = getattr(django_settings, 'MEHO_WEBDAV_UPLOAD_WORKERS', 4)
+
+# size (in bytes) of the reads of remote files from WebDAV servers
+MEHO_WEBDAV_READ_BUFFER = getattr(django_settings, 'MEHO_WEBDAV_READ_BUFFER', 1048576)
+
+# schemes of the volumes whose files are cached locally when read, directory holding the
+# cached files, and maximum size (in bytes) of the cache, beyond which the least recently used
+# files are evicted
+MEHO_VOLUME_CACHE_SCHEMES = getattr(django_settings, 'MEHO_VOLUME_CACHE_SCHEMES', ())
+MEHO_VOLUME_CACHE_ROOT = getattr(django_settings, 'MEHO_VOLUME_CACHE_ROOT',
+    os.path.join(MEHO_TEMP_ROOT, 'meho-volume-cache'))
+MEHO_VOLUME_CACHE_SIZE = getattr(django_settings, 'MEHO_VOLUME_CACHE_SIZE', 10 * 1024 ** 3)
+
+# number of seconds during which a cached file returned by ``path`` can't be evicted, so that it
+# can still be opened by its user (e.g. by the ffmpeg processes of a job)
+MEHO_VOLUME_CACHE_GRACE = getattr(django_settings, 'MEHO_VOLUME_CACHE_GRACE', 3600)
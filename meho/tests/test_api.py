@@ -0,0 +1,121 @@
+# This source file is part of django-meho
+# Main Developer : Dimitri Racordon (kyouko.taiga@gmail.com)
+#
+# Copyright 2013 Dimitri Racordon
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import json
+
+from django.test import TestCase
+from django.test.client import RequestFactory
+from unittest import mock
+from urllib.parse import urlparse
+from meho.models import Media
+from meho.views.api.crud import CrudView, decode_cursor, encode_cursor
+
+class MediaListView(CrudView):
+    model = Media
+
+class ListTestCase(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.urns = sorted(Media.objects.create(private_url='file:///tmp/%i.mp4' % i).urn
+            for i in range(5))
+
+    def get(self, url='/media/', **extra):
+        return MediaListView.as_view()(self.factory.get(url, **extra))
+
+    def content(self, response):
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+class PaginationTest(ListTestCase):
+
+    def test_pages(self):
+        urns, url, pages = [], '/media/?limit=2', 0
+        while url:
+            response = self.get(url)
+            self.assertEqual(response.status_code, 200)
+            body = json.loads(self.content(response))
+            self.assertLessEqual(len(body['media']), 2)
+            urns += [media['urn'] for media in body['media']]
+            pages += 1
+
+            url = body['next']
+            if url:
+                self.assertEqual(response['Link'], '<%s>; rel="next"' % url)
+                url = '%s?%s' % (urlparse(url).path, urlparse(url).query)
+            else:
+                self.assertNotIn('Link', response)
+
+        self.assertEqual(urns, self.urns)
+        self.assertEqual(pages, 3)
+
+    def test_last_page(self):
+        # a page ending on the last object doesn't link to an empty page
+        response = self.get('/media/?limit=5')
+        body = json.loads(self.content(response))
+        self.assertEqual(len(body['media']), 5)
+        self.assertIsNone(body['next'])
+
+    def test_cursor(self):
+        response = self.get('/media/', data={'cursor': encode_cursor(self.urns[2])})
+        body = json.loads(self.content(response))
+        self.assertEqual([media['urn'] for media in body['media']], self.urns[3:])
+
+    def test_filters(self):
+        Media.objects.filter(urn__in=self.urns[:3]).update(status='failed')
+        response = self.get('/media/', data={'status': 'failed', 'limit': 2})
+        body = json.loads(self.content(response))
+        self.assertEqual([media['urn'] for media in body['media']], self.urns[:2])
+        self.assertIn('status=failed', body['next'])
+
+    def test_invalid_parameters(self):
+        for parameters in ({'limit': 'ten'}, {'limit': 0}, {'limit': 10 ** 6},
+                {'cursor': '!'}):
+            self.assertEqual(self.get('/media/', data=parameters).status_code, 400)
+
+    def test_cursor_round_trip(self):
+        for value in (1, 'urn:uuid:0', '2013-01-01T00:00:00'):
+            self.assertEqual(decode_cursor(encode_cursor(value)), value)
+        with self.assertRaises(ValueError):
+            decode_cursor('!')
+
+class StreamingTest(ListTestCase):
+
+    def test_json(self):
+        response = self.get()
+        self.assertEqual(response['Content-Type'], 'application/json')
+        body = json.loads(self.content(response))
+        self.assertEqual(set(body), {'media', 'next'})
+        self.assertEqual([media['urn'] for media in body['media']], self.urns)
+
+    def test_chunks(self):
+        with mock.patch('meho.settings.MEHO_API_CHUNK_SIZE', 2):
+            body = json.loads(self.content(self.get()))
+        self.assertEqual([media['urn'] for media in body['media']], self.urns)
+
+    def test_empty(self):
+        Media.objects.all().delete()
+        self.assertEqual(json.loads(self.content(self.get())), {'media': [], 'next': None})
+
+    def test_ndjson(self):
+        with mock.patch('meho.settings.MEHO_API_CHUNK_SIZE', 2):
+            response = self.get(HTTP_ACCEPT='application/x-ndjson')
+            lines = self.content(response).split('\n')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(lines[-1], '')
+        self.assertEqual([json.loads(line)['urn'] for line in lines[:-1]], self.urns)
@@ -0,0 +1,188 @@
+# This source file is part of django-meho
+# Main Developer : Dimitri Racordon (kyouko.taiga@gmail.com)
+#
+# Copyright 2013 Dimitri Racordon
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import base64, threading
+import requests
+
+from django.contrib.auth import authenticate, get_user_model
+from django.http import HttpResponse
+from django.test import TestCase
+from django.test.client import RequestFactory
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import mock
+from meho.auth import decorators
+from meho.auth.backends import AutoAuth
+from meho.auth.decorators import basic_http_auth
+from meho.models import ApiToken, Credentials
+
+@basic_http_auth(realm='api')
+def whoami(request, user):
+    return HttpResponse(user.username)
+
+def basic(username, password):
+    credentials = ('%s:%s' % (username, password)).encode('utf-8')
+    return 'Basic ' + base64.b64encode(credentials).decode('ascii')
+
+class BasicHttpAuthTest(TestCase):
+
+    def setUp(self):
+        decorators._verified.clear()
+        self.factory = RequestFactory()
+        self.user = get_user_model().objects.create_user('alice', password='secret')
+
+    def get(self, authorization=None):
+        extra = {'HTTP_AUTHORIZATION': authorization} if authorization else {}
+        return whoami(self.factory.get('/', **extra))
+
+    def count_authentications(self, *authorizations):
+        """Returns the responses to requests with ``authorizations`` and the number of hashes."""
+        with mock.patch('meho.auth.decorators.authenticate', wraps=authenticate) as hashes:
+            responses = [self.get(authorization) for authorization in authorizations]
+        return [response.status_code for response in responses], hashes.call_count
+
+    def test_missing(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Basic realm=api')
+
+    def test_malformed(self):
+        for authorization in ('Basic !', 'Basic', 'Bearer xyz'):
+            self.assertEqual(self.get(authorization).status_code, 401)
+
+    def test_cached(self):
+        authorization = basic('alice', 'secret')
+        self.assertEqual(self.count_authentications(*[authorization] * 3), ([200] * 3, 1))
+        self.assertEqual(self.get(authorization).content, b'alice')
+
+    def test_wrong_password(self):
+        authorization = basic('alice', 'wrong')
+        self.assertEqual(self.count_authentications(authorization, authorization),
+            ([401, 401], 2))
+
+    def test_password_change(self):
+        authorization = basic('alice', 'secret')
+        self.assertEqual(self.get(authorization).status_code, 200)
+
+        self.user.set_password('other')
+        self.user.save()
+        self.assertEqual(self.get(authorization).status_code, 401)
+        self.assertEqual(self.get(basic('alice', 'other')).status_code, 200)
+
+    def test_deactivated(self):
+        authorization = basic('alice', 'secret')
+        self.assertEqual(self.get(authorization).status_code, 200)
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get(authorization).status_code, 401)
+
+    def test_expiry(self):
+        authorization = basic('alice', 'secret')
+        with mock.patch('meho.settings.MEHO_API_AUTH_CACHE_TTL', 0):
+            self.assertEqual(self.count_authentications(authorization, authorization),
+                ([200, 200], 2))
+
+    def test_size(self):
+        get_user_model().objects.create_user('bob', password='secret')
+        with mock.patch('meho.settings.MEHO_API_AUTH_CACHE_SIZE', 1):
+            self.assertEqual(self.count_authentications(basic('alice', 'secret'),
+                basic('bob', 'secret'), basic('alice', 'secret')), ([200] * 3, 3))
+        self.assertEqual(len(decorators._verified), 1)
+
+    def test_token(self):
+        key = ApiToken.generate(self.user, 'test')
+        self.assertEqual(self.count_authentications('Token ' + key), ([200], 0))
+        self.assertEqual(self.get('Token ' + key[::-1]).status_code, 401)
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get('Token ' + key).status_code, 401)
+
+class ChallengingServer(HTTPServer):
+    """A server requiring basic authentication, counting the challenges it sent."""
+
+    def __init__(self, authorization):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), ChallengingHandler)
+        self.authorization = authorization
+        self.challenges = 0
+
+class ChallengingHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.headers.get('Authorization') == self.server.authorization:
+            self.send_response(200)
+        else:
+            self.server.challenges += 1
+            self.send_response(401)
+            self.send_header('WWW-Authenticate', 'Basic realm="meho"')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+class AutoAuthTest(TestCase):
+
+    def setUp(self):
+        self.servers = []
+        self.server, self.url, self.credentials = self.start_server()
+        self.auth = AutoAuth(Credentials.objects.all())
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def start_server(self):
+        """Starts a server and returns it, along with an url on it and its credentials."""
+        server = ChallengingServer(basic('meho', 'secret'))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.servers.append(server)
+        credentials = Credentials.objects.create(scheme='basic',
+            origin='127.0.0.1:%i' % server.server_port,
+            data={'username': 'meho', 'password': 'secret'})
+        return server, 'http://127.0.0.1:%i/media.mp4' % server.server_port, credentials
+
+    def test_preemptive(self):
+        # only the first request of a series goes through a challenge
+        for i in range(3):
+            self.assertEqual(requests.get(self.url, auth=self.auth).status_code, 200)
+        self.assertEqual(self.server.challenges, 1)
+
+    def test_rotated_credentials(self):
+        self.assertEqual(requests.get(self.url, auth=self.auth).status_code, 200)
+
+        # the cached handler is rejected, and built again from the new credentials even though
+        # the cached ones haven't expired
+        self.server.authorization = basic('meho', 'rotated')
+        self.credentials.data = {'username': 'meho', 'password': 'rotated'}
+        self.credentials.save()
+        self.assertEqual(requests.get(self.url, auth=self.auth).status_code, 200)
+        self.assertEqual(self.server.challenges, 2)
+
+    def test_eviction(self):
+        # the handler used last is kept, however long ago it was first cached
+        other_server, other_url, other_credentials = self.start_server()
+        last_server, last_url, last_credentials = self.start_server()
+        with mock.patch('meho.settings.MEHO_AUTH_HANDLER_CACHE_SIZE', 2):
+            for url in (self.url, other_url, self.url, last_url, self.url, other_url):
+                self.assertEqual(requests.get(url, auth=self.auth).status_code, 200)
+
+        self.assertEqual(self.server.challenges, 1)
+        self.assertEqual(other_server.challenges, 2)
+        self.assertEqual(last_server.challenges, 1)
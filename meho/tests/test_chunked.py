@@ -0,0 +1,50 @@
+# This source file is part of django-meho
+# Main Developer : Dimitri Racordon (kyouko.taiga@gmail.com)
+#
+# Copyright 2013 Dimitri Racordon
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from django.test import SimpleTestCase
+from unittest import mock
+from meho.core.encoders.chunked import ChunkedFFmpeg
+
+# a keyframe every 2 seconds of a 10 minutes input
+KEYFRAMES = [float(t) for t in range(0, 600, 2)]
+
+@mock.patch('meho.core.encoders.chunked.parse_keyframes', return_value=KEYFRAMES)
+@mock.patch('os.cpu_count', return_value=4)
+class SplitPointsTest(SimpleTestCase):
+
+    def test_split(self, cpu_count, parse_keyframes):
+        segments = ChunkedFFmpeg()._split_points('input.mp4', 600.0)
+        self.assertEqual(segments, [(0.0, 150.0), (150.0, 150.0), (300.0, 150.0),
+            (450.0, 150.0)])
+
+    def test_busy_pool(self, cpu_count, parse_keyframes):
+        # segments only use the CPUs left to the job by the other jobs of its pool
+        pool = mock.Mock(**{'stats.return_value': {'workers': 4, 'running': 2}})
+        with mock.patch('meho.core.workers.current_worker_pool', return_value=pool):
+            self.assertEqual(len(ChunkedFFmpeg()._split_points('input.mp4', 600.0)), 2)
+
+        pool.stats.return_value = {'workers': 4, 'running': 4}
+        with mock.patch('meho.core.workers.current_worker_pool', return_value=pool):
+            self.assertEqual(ChunkedFFmpeg()._split_points('input.mp4', 600.0), [(0.0, 600.0)])
+
+    def test_short_input(self, cpu_count, parse_keyframes):
+        self.assertEqual(ChunkedFFmpeg()._split_points('input.mp4', 60.0), [(0.0, 60.0)])
+
+    def test_segments_setting(self, cpu_count, parse_keyframes):
+        with mock.patch('meho.settings.MEHO_CHUNKED_SEGMENTS', 3):
+            self.assertEqual(len(ChunkedFFmpeg()._split_points('input.mp4', 600.0)), 3)
@@ -0,0 +1,180 @@
+# This source file is part of django-meho
+# Main Developer : Dimitri Racordon (kyouko.taiga@gmail.com)
+#
+# Copyright 2013 Dimitri Racordon
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os, tempfile
+
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.utils import timezone
+from unittest import mock
+from meho.core import jobs
+from meho.core.workers import WorkerPool
+from meho.models import Job, Media
+
+class JobTestCase(TestCase):
+
+    def setUp(self):
+        self.alice = get_user_model().objects.create_user('alice', password='alice')
+        self.bob = get_user_model().objects.create_user('bob', password='bob')
+        self.media_in = Media.objects.create(private_url='file:///tmp/input.mp4')
+
+    def create_job(self, owner=None, priority=0, group='', **kwargs):
+        media_out = Media.objects.create(private_url='file:///tmp/output.mp4',
+            status='transcoding')
+        return Job.objects.create(media_in=self.media_in, media_out=media_out, encoder='copy',
+            owner=owner, priority=priority, group=group, **kwargs)
+
+class ClaimJobsTest(JobTestCase):
+
+    def test_priority(self):
+        low = self.create_job(priority=0)
+        high = self.create_job(priority=10)
+
+        self.assertEqual(jobs.claim_jobs('host:1/a'), [high])
+        self.assertEqual(jobs.claim_jobs('host:1/b'), [low])
+        self.assertEqual(jobs.claim_jobs('host:1/c'), [])
+
+    def test_concurrent_claim(self):
+        first = self.create_job()
+        second = self.create_job()
+
+        # another worker claims the first candidate between the selection of the candidates and
+        # the update marking it as running
+        schedule = jobs.schedule
+        def racing_schedule(candidates, running):
+            Job.objects.filter(pk=first.pk).update(status='running', worker='other:1/a')
+            return schedule(candidates, running)
+
+        with mock.patch('meho.core.jobs.schedule', racing_schedule):
+            claimed = jobs.claim_jobs('host:1/a')
+
+        self.assertEqual(claimed, [second])
+        self.assertEqual(Job.objects.get(pk=first.pk).worker, 'other:1/a')
+        self.assertEqual(Job.objects.get(pk=second.pk).worker, 'host:1/a')
+
+    def test_user_concurrency(self):
+        self.create_job(owner=self.alice)
+        self.create_job(owner=self.alice)
+        bob_job = self.create_job(owner=self.bob)
+
+        with mock.patch('meho.settings.MEHO_JOB_USER_CONCURRENCY', 1):
+            self.assertEqual(jobs.claim_jobs('host:1/a')[0].owner, self.alice)
+            self.assertEqual(jobs.claim_jobs('host:1/b'), [bob_job])
+            self.assertEqual(jobs.claim_jobs('host:1/c'), [])
+
+    def test_group(self):
+        group = [self.create_job(group='g') for i in range(3)]
+        other = self.create_job()
+
+        self.assertEqual(jobs.claim_jobs('host:1/a'), group)
+        self.assertEqual(jobs.claim_jobs('host:1/b'), [other])
+
+    def test_group_user_concurrency(self):
+        group = [self.create_job(owner=self.alice, group='g') for i in range(3)]
+
+        with mock.patch('meho.settings.MEHO_JOB_USER_CONCURRENCY', 2):
+            self.assertEqual(jobs.claim_jobs('host:1/a'), group[:2])
+            self.assertEqual(jobs.claim_jobs('host:1/b'), [])
+        self.assertEqual(Job.objects.get(pk=group[2].pk).status, 'queued')
+
+class RecoverJobsTest(JobTestCase):
+
+    def setUp(self):
+        super(RecoverJobsTest, self).setUp()
+        long_ago = timezone.now() - timedelta(days=1)
+        self.job = self.create_job(status='running', worker='elsewhere:1/a', started=long_ago,
+            progressed_at=long_ago)
+
+    def test_stale(self):
+        self.assertEqual(jobs.recover_jobs(), [self.job])
+        job = Job.objects.get(pk=self.job.pk)
+        self.assertEqual((job.status, job.worker), ('queued', ''))
+
+    def test_heartbeat(self):
+        jobs.heartbeat_jobs('elsewhere:1')
+
+        self.assertEqual(jobs.recover_jobs(), [])
+        self.assertEqual(Job.objects.get(pk=self.job.pk).status, 'running')
+
+    def test_claimed_meanwhile(self):
+        # the job is queued again and claimed by another worker while it's being recovered
+        def reclaiming_worker_died(worker):
+            Job.objects.filter(pk=self.job.pk).update(worker='elsewhere:2/a')
+            return True
+
+        with mock.patch('meho.core.jobs._worker_died', reclaiming_worker_died):
+            self.assertEqual(jobs.recover_jobs(), [])
+        job = Job.objects.get(pk=self.job.pk)
+        self.assertEqual((job.status, job.worker), ('running', 'elsewhere:2/a'))
+
+    def test_work_path(self):
+        fd, work_path = tempfile.mkstemp()
+        os.close(fd)
+        Job.objects.filter(pk=self.job.pk).update(work_path=work_path)
+
+        jobs.recover_jobs()
+        self.assertFalse(os.path.exists(work_path))
+        self.assertEqual(Job.objects.get(pk=self.job.pk).work_path, '')
+
+    def test_taken_over(self):
+        # the job is recovered and claimed by another worker while its first worker runs it
+        self.create_job()
+        job = jobs.claim_jobs('host:1/a')[0]
+
+        class Encoder(object):
+            def transcode(self, media_in, media_out, encoder_string, task_id=None):
+                Job.objects.filter(pk=job.pk).update(worker='host:2/a')
+                media_out.status = 'ready'
+                media_out.save()
+
+        with mock.patch('meho.core.jobs.load_encoder', return_value=Encoder), \
+                mock.patch('meho.core.jobs.fetch_result', return_value=False), \
+                mock.patch('meho.core.jobs.store_result'):
+            jobs.run_jobs([job])
+
+        job = Job.objects.get(pk=job.pk)
+        self.assertEqual((job.status, job.worker), ('running', 'host:2/a'))
+
+class ReleaseJobsTest(JobTestCase):
+
+    def test_release(self):
+        running = self.create_job(status='running', worker='host:1/a', started=timezone.now())
+        cancelling = self.create_job(status='cancelling', worker='host:1/b',
+            started=timezone.now())
+        other = self.create_job(status='running', worker='host:10/a', started=timezone.now())
+
+        self.assertEqual(jobs.release_jobs('host:1'), [running, cancelling])
+        running = Job.objects.get(pk=running.pk)
+        self.assertEqual((running.status, running.worker), ('queued', ''))
+        cancelling = Job.objects.get(pk=cancelling.pk)
+        self.assertEqual((cancelling.status, cancelling.media_out.status), ('cancelled', 'failed'))
+        self.assertEqual(Job.objects.get(pk=other.pk).status, 'running')
+
+    def test_stop_pool(self):
+        fd, work_path = tempfile.mkstemp()
+        os.close(fd)
+        job = self.create_job(status='running', worker='host:1/a', started=timezone.now(),
+            work_path=work_path)
+
+        supervisor = mock.Mock()
+        with mock.patch('meho.core.workers.get_supervisor', return_value=supervisor):
+            self.assertEqual(WorkerPool(size=1, name='host:1').stop(), [job])
+        supervisor.kill_all.assert_called_once_with()
+        self.assertFalse(os.path.exists(work_path))
+        self.assertEqual(Job.objects.get(pk=job.pk).status, 'queued')
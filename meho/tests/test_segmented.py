@@ -0,0 +1,63 @@
+# This source file is part of django-meho
+# Main Developer : Dimitri Racordon (kyouko.taiga@gmail.com)
+#
+# Copyright 2013 Dimitri Racordon
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os, shutil, tempfile
+
+from django.test import TestCase
+from meho.core.encoders.segmented import (SegmentedFFmpeg, compress_names, expand_names,
+    segment_names)
+from meho.models import Media, Metadata
+
+class SegmentNamesTest(TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+        shutil.rmtree(self.output_dir)
+
+    def test_save_segments(self):
+        names = ['index_init.mp4'] + ['index_%05d.ts' % i for i in range(1200)]
+        for name in names + ['index.m3u8']:
+            with open(os.path.join(self.work_dir, name), 'wb') as f:
+                f.write(name.encode('utf-8'))
+
+        media = Media.objects.create(private_url='file://%s/index.m3u8' % self.output_dir)
+        SegmentedFFmpeg()._save_segments({
+            'media': media,
+            'filename': os.path.join(self.work_dir, 'index.m3u8'),
+            'work_dir': self.work_dir
+        })
+
+        self.assertEqual(Metadata.objects.filter(media=media).count(), 1)
+        expected = ['file://%s/%s' % (self.output_dir, name) for name in names]
+        self.assertEqual(sorted(segment_names(media)), sorted(expected))
+        self.assertEqual(sorted(os.listdir(self.output_dir)), sorted(names))
+
+    def test_not_segmented(self):
+        media = Media.objects.create(private_url='file://%s/video.mp4' % self.output_dir)
+        self.assertEqual(segment_names(media), [])
+
+    def test_compress_names(self):
+        names = ['index_%05d.ts' % i for i in range(300)] + ['video_0_%05d.m4s' % i
+            for i in range(1, 10)] + ['video_9.ts', 'video_10.ts', 'index_init.mp4', 'a{1-2}b']
+        compressed = compress_names(names)
+        self.assertIn('+index_{00000-00299}.ts', compressed)
+        self.assertEqual(sorted(expand_names(compressed)), sorted(names))
@@ -0,0 +1,80 @@
+# This source file is part of django-meho
+# Main Developer : Dimitri Racordon (kyouko.taiga@gmail.com)
+#
+# Copyright 2013 Dimitri Racordon
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os, shutil, stat, tempfile, time
+
+from django.test import SimpleTestCase
+from meho.core.encoders.supervisor import FFmpegSupervisor, limit_command
+
+class SupervisorTest(SimpleTestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.supervisor = FFmpegSupervisor()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def command(self, script):
+        """Returns a command running the shell ``script``, which ignores ffmpeg arguments."""
+        filename = os.path.join(self.temp_dir, 'command.sh')
+        with open(filename, 'w') as f:
+            f.write('#!/bin/sh\n' + script)
+        os.chmod(filename, stat.S_IRWXU)
+        return [filename]
+
+    def wait_for(self, predicate, timeout=10):
+        deadline = time.time() + timeout
+        while not predicate():
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.05)
+
+    def test_run(self):
+        self.assertEqual(self.supervisor.run('task', self.command('exit 3')), 3)
+
+    def test_timeout(self):
+        status = self.supervisor.run('task', self.command('sleep 30'), timeout=0.5)
+        self.assertLess(status, 0)
+
+    def test_kill_all(self):
+        # the processes spawned by supervised processes are killed too
+        pid_file = os.path.join(self.temp_dir, 'pid')
+        future = self.supervisor.submit('task', self.command(
+            'sleep 30 &\necho $! > %s\nwait\n' % pid_file))
+        self.wait_for(lambda: os.path.exists(pid_file) and os.path.getsize(pid_file))
+        with open(pid_file) as f:
+            child = int(f.read())
+
+        self.assertEqual(self.supervisor.kill_all(), 1)
+        self.assertLess(future.result(timeout=10), 0)
+        self.wait_for(lambda: not process_exists(child))
+
+        # processes spawned afterwards are killed right away
+        self.assertLess(self.supervisor.run('task', self.command('sleep 30'), timeout=10), 0)
+
+    def test_limit_command(self):
+        self.assertEqual(limit_command({}), [])
+        self.assertEqual(limit_command({'nice': 5, 'cpu_affinity': [0, 2], 'memory': 1024}),
+            ['nice', '-n', '5', 'taskset', '-c', '0,2', 'prlimit', '--as=1024', '--'])
+
+def process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
@@ -0,0 +1,191 @@
+# This source file is part of django-meho
+# Main Developer : Dimitri Racordon (kyouko.taiga@gmail.com)
+#
+# Copyright 2013 Dimitri Racordon
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import gzip, io, os, re
+import shutil, tempfile, threading
+
+from django.test import SimpleTestCase
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from unittest import mock
+from meho.core.volumes.webdav import WebdavVolumeDriver
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    """A minimal WebDAV server keeping resources in memory, accepting partial PUT requests."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StandInHandler)
+        self.resources = {}
+        self.lock = threading.Lock()
+        # offsets of the chunks whose upload fails, and number of bytes received by PUT requests
+        self.failing_offsets = set()
+        self.received = 0
+        # content coding applied to GET responses, which ignore ``Range`` headers anyway
+        self.content_encoding = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%i' % self.server_port
+
+class StandInHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body=b'', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        with self.server.lock:
+            resource = self.server.resources.get(self.path)
+        if resource is None:
+            return self.reply(404)
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(resource)))
+        self.end_headers()
+
+    def do_GET(self):
+        with self.server.lock:
+            resource = self.server.resources.get(self.path)
+        if resource is None:
+            return self.reply(404)
+        if self.server.content_encoding == 'gzip':
+            return self.reply(200, gzip.compress(bytes(resource)), {'Content-Encoding': 'gzip'})
+        self.reply(200, bytes(resource))
+
+    def do_PUT(self):
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        match = re.match(r'bytes (\d+)-(\d+)/(\d+)', self.headers.get('Content-Range', ''))
+        with self.server.lock:
+            if match and int(match.group(1)) in self.server.failing_offsets:
+                return self.reply(500)
+            self.server.received += len(data)
+            if match:
+                start, total = int(match.group(1)), int(match.group(3))
+                resource = self.server.resources.setdefault(self.path, bytearray(total))
+                resource[start:start + len(data)] = data
+            else:
+                self.server.resources[self.path] = bytearray(data)
+        self.reply(201)
+
+    def do_DELETE(self):
+        with self.server.lock:
+            found = self.server.resources.pop(self.path, None) is not None
+        self.reply(204 if found else 404)
+
+    def do_MKCOL(self):
+        self.reply(405)
+
+    def do_MOVE(self):
+        destination = re.sub(r'^https?://[^/]+', '', self.headers['Destination'])
+        with self.server.lock:
+            self.server.resources[destination] = self.server.resources.pop(self.path)
+        self.reply(201)
+
+class ChunkedUploadTest(SimpleTestCase):
+
+    def setUp(self):
+        self.server = StandInServer()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.temp_root = tempfile.mkdtemp()
+
+        # meho settings are read once, when ``meho.settings`` is imported
+        self.settings_override = mock.patch.multiple('meho.settings',
+            MEHO_TEMP_ROOT=self.temp_root, MEHO_WEBDAV_CHUNK_SIZE=1024,
+            MEHO_WEBDAV_UPLOAD_WORKERS=1, MEHO_WEBDAV_RETRIES=0)
+        self.settings_override.start()
+        self.volume = WebdavVolumeDriver(identities=[])
+        self.name = self.server.url + '/media/video.mp4'
+
+    def tearDown(self):
+        self.settings_override.stop()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.temp_root)
+
+    def test_upload(self):
+        content = os.urandom(10 * 1024 + 17)
+        self.volume.save(self.name, io.BytesIO(content))
+
+        self.assertEqual(bytes(self.server.resources['/media/video.mp4']), content)
+        self.assertNotIn('/media/video.mp4.part', self.server.resources)
+        self.assertEqual(os.listdir(self.temp_root), [])
+
+    def test_resume(self):
+        content = os.urandom(10 * 1024)
+        self.server.failing_offsets.add(6 * 1024)
+        with self.assertRaises(Exception):
+            self.volume.save(self.name, io.BytesIO(content))
+        self.assertNotIn('/media/video.mp4', self.server.resources)
+
+        # only the chunks that weren't acknowledged are sent again
+        self.server.failing_offsets.clear()
+        self.server.received = 0
+        self.volume.save(self.name, io.BytesIO(content))
+
+        self.assertEqual(bytes(self.server.resources['/media/video.mp4']), content)
+        self.assertLess(self.server.received, len(content))
+
+    def test_resume_with_other_content(self):
+        self.server.failing_offsets.add(6 * 1024)
+        with self.assertRaises(Exception):
+            self.volume.save(self.name, io.BytesIO(os.urandom(10 * 1024)))
+
+        # a file of the same size doesn't resume on top of the chunks of the previous one
+        self.server.failing_offsets.clear()
+        content = os.urandom(10 * 1024)
+        self.volume.save(self.name, io.BytesIO(content))
+
+        self.assertEqual(bytes(self.server.resources['/media/video.mp4']), content)
+
+class StreamingReadTest(SimpleTestCase):
+
+    def setUp(self):
+        self.server = StandInServer()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.volume = WebdavVolumeDriver(identities=[])
+        self.name = self.server.url + '/media/video.mp4'
+        self.content = os.urandom(64 * 1024)
+        self.server.resources['/media/video.mp4'] = bytearray(self.content)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_seek_without_range(self):
+        with self.volume.open(self.name) as f:
+            f.seek(40000)
+            self.assertEqual(f.read(), self.content[40000:])
+            f.seek(100)
+            self.assertEqual(f.read(100), self.content[100:200])
+
+    def test_seek_with_content_encoding(self):
+        # positions count the bytes sent by the server, whether it encoded them or not
+        self.server.content_encoding = 'gzip'
+        with self.volume.open(self.name) as f:
+            sent = f.read()
+            f.seek(1000)
+            self.assertEqual(f.read(), sent[1000:])
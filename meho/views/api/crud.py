@@ -15,14 +15,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import json
+import base64, json
+import meho.settings as meho_settings
 
 from collections.abc import Mapping
 from django.core.exceptions import ImproperlyConfigured, ValidationError
 from django.forms.models import model_to_dict
-from django.http import Http404, HttpResponse
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.views.generic import View
 
+# query parameters selecting a page of objects, which aren't queryset filters
+PAGE_PARAMETERS = ('limit', 'cursor')
+
 class ReadMixin(object):
     """A mixin provides a way to get a queryset on a model."""
 
@@ -102,6 +106,9 @@ class SingleReadMixin(ReadMixin):
 class MultipleReadMixin(ReadMixin):
     """A mixin that provides a way to render multiple model instances."""
 
+    # field ordering the pages of objects; its values must be unique and JSON serializable
+    cursor_field = 'pk'
+
     def get_model_name_plural(self):
         if self.model:
             return self.model._meta.verbose_name_plural
@@ -122,12 +129,96 @@ class MultipleReadMixin(ReadMixin):
             queryset = self.get_queryset()
         return queryset.all()
 
+    def paginate_objects(self, queryset):
+        """
+        Returns a queryset of the page of ``queryset`` selected by the ``limit`` and ``cursor``
+        parameters of the request, and the url of the next page, or ``None`` if it's the last
+        page.
+
+        Pages are ordered by ``cursor_field``, and the cursor holds the last value of the
+        previous page, so that each page is a range scan of an index, however deep it is in the
+        list. Raises ``ValueError`` if the parameters are invalid.
+        """
+        limit = self.request.GET.get('limit', meho_settings.MEHO_API_PAGE_SIZE)
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValueError('limit must be an integer')
+        if not 0 < limit <= meho_settings.MEHO_API_MAX_PAGE_SIZE:
+            raise ValueError('limit must be between 1 and %i' % (
+                meho_settings.MEHO_API_MAX_PAGE_SIZE))
+
+        queryset = queryset.order_by(self.cursor_field)
+        if 'cursor' in self.request.GET:
+            after = decode_cursor(self.request.GET['cursor'])
+            queryset = queryset.filter(**{self.cursor_field + '__gt': after})
+
+        # look up the last key of the page and whether there's a next one with a query reading
+        # keys only, so that the page itself can be streamed
+        keys = list(queryset.values_list(self.cursor_field, flat=True)[limit - 1:limit + 1])
+        if len(keys) < 2:
+            # rows may be inserted before the page is streamed
+            return queryset[:limit], None
+
+        queryset = queryset.filter(**{self.cursor_field + '__lte': keys[0]})
+        params = self.request.GET.copy()
+        params['cursor'] = encode_cursor(keys[0])
+        return queryset, self.request.build_absolute_uri(
+            self.request.path + '?' + params.urlencode())
+
     def render_objects(self, status=200):
+        """
+        Returns a streaming response serializing the objects one chunk at a time, as a JSON
+        document, or as newline-delimited JSON if the request accepts
+        ``application/x-ndjson``; either way, memory doesn't grow with the number of objects.
+        """
         if not hasattr(self, 'objects'):
             self.objects = self.get_objects()
 
-        response = { self.get_model_name_plural(): [model_to_dict(o) for o in self.objects] }
-        return HttpResponse(json.dumps(response), status=status, content_type='application/json')
+        if 'application/x-ndjson' in self.request.META.get('HTTP_ACCEPT', ''):
+            response = StreamingHttpResponse(self.stream_ndjson(), status=status,
+                content_type='application/x-ndjson')
+        else:
+            response = StreamingHttpResponse(self.stream_json(), status=status,
+                content_type='application/json')
+        if getattr(self, 'next_url', None):
+            response['Link'] = '<%s>; rel="next"' % self.next_url
+        return response
+
+    def stream_json(self):
+        yield '{%s: [' % json.dumps(self.get_model_name_plural())
+        separator = ''
+        for chunk in self.iter_chunks():
+            yield separator + ', '.join(json.dumps(model_to_dict(o)) for o in chunk)
+            separator = ', '
+        yield ']'
+        if hasattr(self, 'next_url'):
+            yield ', "next": %s' % json.dumps(self.next_url)
+        yield '}'
+
+    def stream_ndjson(self):
+        # the url of the next page is given by the link header only
+        for chunk in self.iter_chunks():
+            yield ''.join(json.dumps(model_to_dict(o)) + '\n' for o in chunk)
+
+    def iter_chunks(self):
+        """
+        Yields the objects in lists of ``MEHO_API_CHUNK_SIZE``, fetching querysets from the
+        database without caching their results.
+        """
+        chunk_size = meho_settings.MEHO_API_CHUNK_SIZE
+        objects = self.objects
+        if hasattr(objects, 'iterator'):
+            objects = objects.iterator()
+
+        chunk = []
+        for obj in objects:
+            chunk.append(obj)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
 
 class EditMixin(SingleReadMixin):
     """A mixin that provides a way to handle the edition of an model object."""
@@ -262,12 +353,16 @@ class CrudView(CreateMixin, MultipleReadMixin, UpdateMixin, DeleteMixin, View):
         # otherwise if the requested path has a trailing '/', render a list of objects
         elif request.path[-1] == '/':
             queryset = self.get_queryset()
-            if request.GET:
+            filters = {k: v for k,v in request.GET.items() if k not in PAGE_PARAMETERS}
+            if filters:
                 # apply queryset filters if provided
                 from urllib.parse import unquote
-                queryset = queryset.filter(**{k: unquote(v) for k,v in request.GET.items()})
+                queryset = queryset.filter(**{k: unquote(v) for k,v in filters.items()})
 
-            self.objects = self.get_objects(queryset)
+            try:
+                self.objects, self.next_url = self.paginate_objects(self.get_objects(queryset))
+            except ValueError as e:
+                return self.invalid_request_body(str(e))
             return self.render_objects()
 
         # if it's neither a request for a single nor multiple objects, raise a 404
@@ -278,3 +373,14 @@ class CrudView(CreateMixin, MultipleReadMixin, UpdateMixin, DeleteMixin, View):
 
     def delete(self, request, *args, **kwargs):
         return self.delete_object()
+
+def encode_cursor(value):
+    """Returns an opaque cursor designating the objects after ``value``."""
+    return base64.urlsafe_b64encode(json.dumps(value).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    """Returns the value designated by ``cursor``; raises ``ValueError`` if it's invalid."""
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except ValueError:
+        raise ValueError('invalid cursor')
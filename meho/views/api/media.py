@@ -19,6 +19,9 @@ import json
 import os, tempfile
 import meho.settings as meho_settings
 
+from collections.abc import Mapping
+from django.db import transaction
+from django.forms.models import model_to_dict
 from django.http import HttpResponse, HttpResponseBadRequest
 from django.views.generic import View
 from django.views.generic.edit import ModelFormMixin
@@ -26,9 +29,11 @@ from django.utils.decorators import method_decorator
 
 from meho.auth.decorators import basic_http_auth
 from meho.models import Media
-from meho.core.encoders import load_encoder
+from meho.core.jobs import QueueFull, enqueue_jobs
+from meho.core.probe import ProbeError, probe_media
+from meho.core.volumes import get_volume
 from meho.core.publishers import PublisherSelector
-from meho.views.api.crud import ReadMixin, EditMixin, CrudView
+from meho.views.api.crud import ReadMixin, SingleReadMixin, EditMixin, CrudView
 
 class MediaCrudView(CrudView):
 
@@ -63,30 +68,85 @@ class TranscodeView(EditMixin, View):
         # retrieve input media
         media_in = self.get_object()
 
-        # retrieve request parameters
+        # retrieve request parameters; several renditions of the input media can be requested
+        # at once with a list of outputs, each having its own media and encoder string
         rq_body = self.parse_request_body()
-        media_out_kwargs = self.get_object_kwargs()
-        media_out_kwargs['status'] = 'transcoding'
-        media_out_kwargs['parent'] = media_in
-        if 'private_url' not in media_out_kwargs:
-            return self.invalid_request_body('Output private_url is required')
+        if not isinstance(rq_body, Mapping):
+            return self.invalid_request_body('Request data must be an object.')
+        if 'outputs' in rq_body:
+            if not isinstance(rq_body['outputs'], list) or not rq_body['outputs']:
+                return self.invalid_request_body('outputs must be a non-empty list')
+            outputs = rq_body['outputs']
+        else:
+            outputs = [rq_body]
+
+        media_out_kwargs = []
+        for output in outputs:
+            if not isinstance(output, Mapping) or not isinstance(output.get('media'), Mapping):
+                return self.invalid_request_body(
+                    'Request data must contain a %s object.' % self.get_model_name())
+            kwargs = {k:v for k,v in output['media'].items() if k in self.fields}
+            if 'private_url' not in kwargs:
+                return self.invalid_request_body('Output private_url is required')
+            kwargs['status'] = 'transcoding'
+            kwargs['parent'] = media_in
+            media_out_kwargs.append((kwargs, output.get('encoder_string', '')))
 
-        # create output media
-        media_out = Media(**media_out_kwargs)
-        media_out.save()
-
-        # start transcoding job
         encoder = rq_body.get('encoder', meho_settings.MEHO_DEFAULT_ENCODER)
-        encoder_string = rq_body.get('encoder_string', '')
         if encoder not in meho_settings.MEHO_ENCODERS:
             return HttpResponseBadRequest(encoder + ' is not a valid encoder.')
 
-        encoder = load_encoder(meho_settings.MEHO_ENCODERS[encoder])()
-        encoder.transcode(media_in, media_out, encoder_string)
+        # jobs with a higher priority are run first; only staff users may go beyond the range
+        # of priorities allowed by the settings
+        priority = rq_body.get('priority', 0)
+        min_priority, max_priority = meho_settings.MEHO_JOB_PRIORITIES
+        if isinstance(priority, bool) or not isinstance(priority, int):
+            return self.invalid_request_body('priority must be an integer')
+        if not user.is_staff and not min_priority <= priority <= max_priority:
+            return self.invalid_request_body('priority must be between %i and %i' % (
+                min_priority, max_priority))
+
+        # create output media and queue transcoding jobs; none of them is created if one fails
+        try:
+            with transaction.atomic():
+                jobs_outputs = []
+                for kwargs, encoder_string in media_out_kwargs:
+                    media_out = Media(**kwargs)
+                    media_out.save()
+                    jobs_outputs.append((media_out, encoder_string))
+                jobs = enqueue_jobs(media_in, jobs_outputs, encoder, priority, owner=user)
+        except QueueFull as e:
+            response = {'status': 'error', 'message': str(e)}
+            return HttpResponse(json.dumps(response), status=503, content_type='application/json')
 
         # return the freshly created media
-        self.object = media_out
-        return self.render_object()
+        if 'outputs' in rq_body:
+            response = {'media': [model_to_dict(job.media_out) for job in jobs]}
+            response = HttpResponse(json.dumps(response), content_type='application/json')
+        else:
+            self.object = jobs[0].media_out
+            response = self.render_object()
+        response['X-Meho-Task'] = ', '.join(job.task_id for job in jobs)
+        return response
+
+class ProbeView(SingleReadMixin, View):
+
+    model = Media
+
+    @method_decorator(basic_http_auth(realm='api'))
+    def get(self, request, user, pk):
+        self.object = self.get_object()
+        if not get_volume(self.object.private_url).exists(self.object.private_url):
+            response = {'status': 'error', 'message': 'The file of %s does not exist.' % (
+                self.object)}
+            return HttpResponse(json.dumps(response), status=404, content_type='application/json')
+
+        try:
+            response = {'probe': probe_media(self.object)}
+        except ProbeError as e:
+            response = {'status': 'error', 'message': str(e)}
+            return HttpResponse(json.dumps(response), status=422, content_type='application/json')
+        return HttpResponse(json.dumps(response), content_type='application/json')
 
 class PublishView(EditMixin, View):
 
@@ -18,15 +18,49 @@
 import json
 
 from django.core.cache import cache
-from django.http import HttpResponse, HttpResponseNotFound
-from django.views.decorators.http import require_safe
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseNotFound
+from django.views.decorators.http import require_http_methods, require_safe
+from meho.auth.decorators import basic_http_auth
+from meho.core.jobs import cancel_job, queue_stats
+from meho.models import Job
 
-@require_safe
+@require_http_methods(['GET', 'HEAD', 'DELETE'])
 def single(request, task_id):
+    if request.method == 'DELETE':
+        return cancel(request, task_id)
+
     # retrieve task status from the cache
     task_status = cache.get(task_id)
     if task_status:
         return HttpResponse(json.dumps(task_status), content_type='application/json')
 
-    # specified task could not be found within the cache, maybe it expired
-    return HttpResponseNotFound('Task not found.')
+    # specified task could not be found within the cache, maybe it expired; fall back on the
+    # status recorded in the job table
+    try:
+        job = Job.objects.get(task_id=task_id)
+    except Job.DoesNotExist:
+        return HttpResponseNotFound('Task not found.')
+
+    task_status = {'status': job.status, 'eta': 0, 'progress': 100 if job.finished else 0}
+    return HttpResponse(json.dumps(task_status), content_type='application/json')
+
+@basic_http_auth(realm='api')
+def cancel(request, user, task_id):
+    try:
+        job = Job.objects.get(task_id=task_id)
+    except Job.DoesNotExist:
+        return HttpResponseNotFound('Task not found.')
+
+    # only the owner of a job or staff users can cancel it
+    if job.owner_id is not None and job.owner_id != user.pk and not user.is_staff:
+        return HttpResponseForbidden('You are not allowed to cancel this task.')
+
+    if not cancel_job(job):
+        response = {'status': 'error', 'message': 'Task %s has already finished.' % task_id}
+        return HttpResponse(json.dumps(response), status=409, content_type='application/json')
+    return HttpResponse(status=204)
+
+@require_safe
+def queue(request):
+    # report the load of the job queue, shared by all workers
+    return HttpResponse(json.dumps(queue_stats()), content_type='application/json')
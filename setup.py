@@ -43,6 +43,6 @@ setup(
         "License :: OSI Approved :: Apache Software License",
     ],
     extras_require = {},
-    install_requires = ['django', 'requests'],
+    install_requires = ['django>=1.6,<1.9', 'requests'],
     entry_points={},
 )
\ No newline at end of file